@@ -2,6 +2,7 @@
 
 import logging
 import json
+import os
 
 import gi
 gi.require_version('Gdk', '3.0')
@@ -12,12 +13,15 @@ from gi.repository import Gdk
 from gi.repository import Gtk
 
 from sugar3.activity import activity
+from sugar3.datastore import datastore
 from sugar3.presence.presenceservice import PresenceService
 from sugar3.activity.widgets import ActivityToolbarButton
 from sugar3.activity.widgets import StopButton
 from sugar3.graphics.toolbarbox import ToolbarBox
 from sugar3.graphics.toolbutton import ToolButton
 from sugar3.graphics.toggletoolbutton import ToggleToolButton
+from sugar3.graphics.palettemenu import PaletteMenuBox
+from sugar3.graphics.palettemenu import PaletteMenuItem
 from sugar3.graphics.alert import ErrorAlert
 from sugar3.graphics.alert import NotifyAlert
 from sugar3 import profile
@@ -25,6 +29,28 @@ from gettext import gettext as _
 
 from textchannel import TextChannelWrapper
 import game
+import generators
+import render
+
+# the names shown for generators.ENGINES
+ALGORITHM_NAMES = {
+    'backtracker': _('Backtracker'),
+    'growing-tree': _('Growing tree'),
+    'growing-tree-winding': _('Growing tree, winding'),
+    'growing-tree-flat': _('Growing tree, flat'),
+    'prim': _('Prim'),
+    'kruskal': _('Kruskal'),
+    'braid': _('Braid'),
+    'eller': _('Eller'),
+}
+
+# the walking speeds offered, in steps per second, see
+# game.MazeGame.set_tick_rate()
+TICK_RATES = (
+    (5, _('Slow')),
+    (game.MazeGame.TICK_RATE, _('Normal')),
+    (20, _('Fast')),
+)
 
 
 class MazeActivity(activity.Activity):
@@ -116,6 +142,13 @@ class MazeActivity(activity.Activity):
         harder_button.connect('clicked', self._harder_button_cb)
         toolbar_box.toolbar.insert(harder_button, -1)
 
+        self._targeted_button = ToggleToolButton('target-difficulty')
+        self._targeted_button.set_tooltip(_('Pick levels by difficulty'))
+        if self.state and self.state.get('targeted'):
+            self._targeted_button.set_active(True)
+        self._targeted_button.connect('toggled', self._targeted_button_cb)
+        toolbar_box.toolbar.insert(self._targeted_button, -1)
+
         self._risk_button = ToggleToolButton('make-risk')
         self._risk_button.set_tooltip(_('Make risk'))
         if self.state and 'risk' in self.state:
@@ -123,11 +156,37 @@ class MazeActivity(activity.Activity):
         self._risk_button.connect('toggled', self._make_risk_button_cb)
         toolbar_box.toolbar.insert(self._risk_button, -1)
 
+        self._algorithm_button = ToolButton('maze-algorithm')
+        self._algorithm_button.set_tooltip(_('Maze algorithm'))
+        self._algorithm_button.connect('clicked', self._algorithm_button_cb)
+        menu_box = PaletteMenuBox()
+        for name in generators.ENGINES:
+            item = PaletteMenuItem(ALGORITHM_NAMES.get(name, name))
+            item.connect('activate', self._algorithm_item_cb, name)
+            menu_box.append_item(item)
+            item.show()
+        self._algorithm_button.props.palette.set_content(menu_box)
+        menu_box.show()
+        toolbar_box.toolbar.insert(self._algorithm_button, -1)
+
         self._mode_button = ToggleToolButton('light-theme')
         self._mode_button.set_tooltip(_('Switch to Light Theme'))
         self._mode_button.connect('toggled', self._mode_button_cb)
         toolbar_box.toolbar.insert(self._mode_button, -1)
 
+        self._speed_button = ToolButton('walk-speed')
+        self._speed_button.set_tooltip(_('Walking speed'))
+        self._speed_button.connect('clicked', self._speed_button_cb)
+        menu_box = PaletteMenuBox()
+        for rate, label in TICK_RATES:
+            item = PaletteMenuItem(label)
+            item.connect('activate', self._speed_item_cb, rate)
+            menu_box.append_item(item)
+            item.show()
+        self._speed_button.props.palette.set_content(menu_box)
+        menu_box.show()
+        toolbar_box.toolbar.insert(self._speed_button, -1)
+
         separator = Gtk.SeparatorToolItem()
         toolbar_box.toolbar.insert(separator, -1)
         separator.show()
@@ -138,6 +197,19 @@ class MazeActivity(activity.Activity):
         self.show_trail_button.connect('toggled', self._toggled_show_trail_cb)
         toolbar_box.toolbar.insert(self.show_trail_button, -1)
 
+        export_button = ToolButton('export-maze')
+        export_button.set_tooltip(_('Save maze as PDF'))
+        export_button.connect('clicked', self._export_button_cb)
+        toolbar_box.toolbar.insert(export_button, -1)
+
+        # shown only while a big maze is being generated
+        self._progress_item = Gtk.ToolItem()
+        self._progress_bar = Gtk.ProgressBar()
+        self._progress_bar.set_valign(Gtk.Align.CENTER)
+        self._progress_item.add(self._progress_bar)
+        self._progress_item.set_no_show_all(True)
+        toolbar_box.toolbar.insert(self._progress_item, -1)
+
         separator = Gtk.SeparatorToolItem()
         separator.props.draw = False
         separator.set_size_request(0, -1)
@@ -154,6 +226,16 @@ class MazeActivity(activity.Activity):
 
         return toolbar_box
 
+    def show_progress(self, fraction):
+        """Show how much of a new maze has been generated, or hide the
+        progress bar when fraction is None."""
+        if fraction is None:
+            self._progress_item.hide()
+        else:
+            self._progress_bar.set_fraction(fraction)
+            self._progress_item.show()
+            self._progress_bar.show()
+
     def disable_risk(self):
         self._risk_button.set_sensitive(False)
 
@@ -171,6 +253,21 @@ class MazeActivity(activity.Activity):
     def _harder_button_cb(self, button):
         self.game.harder()
 
+    def _targeted_button_cb(self, button):
+        self.game.set_targeted(button.get_active())
+
+    def _algorithm_button_cb(self, button):
+        button.props.palette.popup(immediate=True)
+
+    def _algorithm_item_cb(self, item, name):
+        self.game.set_algorithm(name)
+
+    def _speed_button_cb(self, button):
+        button.props.palette.popup(immediate=True)
+
+    def _speed_item_cb(self, item, rate):
+        self.game.set_tick_rate(rate)
+
     def _update_mode(self, light_mode):
         if light_mode:
             self._mode_button.set_icon_name('dark-theme')
@@ -191,6 +288,22 @@ class MazeActivity(activity.Activity):
         if self.game.set_show_trail(button.get_active()):
             self.broadcast_msg('show_trail:%s' % str(button.get_active()))
 
+    def _export_button_cb(self, button):
+        """Save the maze being played to the Journal, as a PDF to
+        print."""
+        maze = self.game.maze
+        path = os.path.join(self.get_activity_root(), 'instance',
+                            'maze-%d.pdf' % maze.seed)
+        render.export(maze, path)
+        dsobject = datastore.create()
+        dsobject.metadata['title'] = _('Maze %(width)dx%(height)d') % \
+            {'width': maze.width, 'height': maze.height}
+        dsobject.metadata['mime_type'] = 'application/pdf'
+        dsobject.set_file_path(path)
+        datastore.write(dsobject, transfer_ownership=True)
+        dsobject.destroy()
+        self._add_alert(_('Saved'), _('The maze is in the Journal.'))
+
     def _shared_cb(self, activity):
         logging.debug('Maze was shared')
         self._add_alert(_('Sharing'), _('This maze is shared.'))
@@ -205,6 +318,7 @@ class MazeActivity(activity.Activity):
             self._buddy_already_exists(buddy)
         self._setup()
         # request maze data
+        self.game.send_versions()
         self.broadcast_msg('req_maze')
 
     def _setup(self):
@@ -279,7 +393,11 @@ class MazeActivity(activity.Activity):
                 'width': self.game.maze.width,
                 'height': self.game.maze.height,
                 'finish_time': self.game.finish_time,
-                'risk': self.game.maze.risk}
+                'risk': self.game.maze.risk,
+                'version': self.game.maze.version,
+                'algorithm': self.game.maze.algorithm,
+                'targeted': self.game.targeted,
+                'tick_rate': self.game.tick_rate}
 
         logging.debug('Saving data: %s', data)
         self.metadata['state'] = json.dumps(data)
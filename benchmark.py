@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Microbenchmarks for the maze model.
+
+Run them from the activity directory, all of them or just some:
+
+    python3 benchmark.py
+    python3 benchmark.py dig can_go
+"""
+
+import os
+import sys
+import time
+import timeit
+import tracemalloc
+
+from maze import Grid, Maze
+
+BENCHMARKS = {}
+
+# (width, height) of the smallest, a middle and the largest level
+SIZES = ((15, 9), (91, 51), (223, 125))
+
+
+def benchmark(function):
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def report(label, seconds, unit='call'):
+    if seconds < 1e-3:
+        print('  %-32s %10.3f us/%s' % (label, seconds * 1e6, unit))
+    else:
+        print('  %-32s %10.3f ms/%s' % (label, seconds * 1e3, unit))
+
+
+def best(function, number):
+    """Best time per call of function over a few repeats."""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+@benchmark
+def dig():
+    """Carve the maze passages, without the holes."""
+    for width, height in SIZES:
+        maze = Maze(0, width, height, 0)
+
+        def carve():
+            maze.map = Grid(width, height, Maze.SOLID, Maze.BORDER)
+            maze.dig(1, 1)
+
+        report('%dx%d' % (width, height), best(carve, 5))
+
+
+@benchmark
+def generate():
+    """Build a whole Maze, with holes, at 9, 51 and 125 rows."""
+    for version in Maze.VERSIONS:
+        for width, height in SIZES:
+            seeds = iter(range(1000000))
+
+            def build():
+                Maze(next(seeds), width, height, 1, version)
+
+            report('%dx%d version %d' % (width, height, version),
+                   best(build, 5))
+
+
+@benchmark
+def risk():
+    """Place the holes of a risk maze (on a copy of a carved maze)."""
+    for version in Maze.VERSIONS:
+        for width, height in SIZES:
+            maze = Maze(0, width, height, 0, version)
+
+            def place():
+                maze.copy()._make_risk()
+
+            report('%dx%d version %d' % (width, height, version),
+                   best(place, 20))
+
+
+@benchmark
+def engines():
+    """Every generators.ENGINES: rooms carved per second and the peak
+    memory allocated while building a maze."""
+    import generators
+    for name in generators.ENGINES:
+        for width, height in SIZES:
+            seeds = iter(range(1000000))
+
+            def build():
+                Maze(next(seeds), width, height, 0, Maze.XORSHIFT, name)
+
+            rooms = ((width - 1) // 2) * ((height - 1) // 2)
+            seconds = best(build, 5)
+            tracemalloc.start()
+            build()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('  %-32s %10.0f rooms/s %8.1f KiB peak' %
+                  ('%s %dx%d' % (name, width, height), rooms / seconds,
+                   peak / 1024.0))
+
+
+@benchmark
+def solver():
+    """The distance field of the largest maze, and its lookups."""
+    from solver import DistanceField
+    width, height = SIZES[-1]
+    maze = Maze(0, width, height, 0, Maze.XORSHIFT)
+    report('build %dx%d' % (width, height),
+           best(lambda: DistanceField(maze), 5))
+
+    field = DistanceField(maze)
+    cells = [(x, y) for x in range(width) for y in range(height)
+             if field.distance(x, y) > 0]
+
+    def distances():
+        for x, y in cells:
+            field.distance(x, y)
+
+    def next_steps():
+        for x, y in cells:
+            field.next_step(x, y)
+
+    report('distance()', best(distances, 3) / len(cells))
+    report('next_step()', best(next_steps, 3) / len(cells))
+    steps = field.distance(1, 1)
+    report('path() of %d steps' % steps,
+           best(lambda: field.path(1, 1), 20))
+
+    # pass every hole of a risk maze, from a fresh field each time
+    risky = Maze(0, width, height, 1, Maze.XORSHIFT)
+    fields = []
+
+    def setup():
+        fields.append(DistanceField(risky))
+
+    def open_holes():
+        field = fields.pop()
+        for x, y in risky.holes:
+            field.open(x, y)
+
+    report('open() %d holes' % len(risky.holes),
+           min(timeit.repeat(open_holes, setup, number=1, repeat=20)))
+
+
+@benchmark
+def corridors():
+    """Auto-walk in the largest maze: the corridor graph, and walking
+    every corridor with Engine.keep_going() or CorridorGraph.run()."""
+    from corridors import CorridorGraph
+    from engine import Engine
+    width, height = SIZES[-1]
+    maze = Maze(0, width, height, 0, Maze.XORSHIFT)
+    report('build %dx%d' % (width, height),
+           best(lambda: CorridorGraph(maze), 5))
+
+    graph = CorridorGraph(maze)
+    starts = [(maze.map.position(node), direction)
+              for node in graph.nodes for direction in Maze.DIRECTIONS
+              if maze.validMove(*maze.map.position(
+                  node + maze.map.offsets[direction]))]
+
+    engine = Engine(maze)
+    store = engine.players
+    slot = engine.add()
+
+    def keep_going():
+        for (x, y), direction in starts:
+            store.move(slot, x, y)
+            while direction != (0, 0):
+                engine.move(slot, direction)
+                engine.keep_going(slot, direction)
+                direction = (store.dx[slot], store.dy[slot])
+
+    def run():
+        for (x, y), direction in starts:
+            graph.run(x, y, direction)
+
+    report('keep_going(), %d corridors' % len(starts),
+           best(keep_going, 3))
+    report('run(), %d corridors' % len(starts), best(run, 3))
+
+
+@benchmark
+def players():
+    """A classroom of 30 players in a PlayerStore: finding who walks,
+    who has not finished and who stands on a tile, as each tick, finish
+    and redraw do."""
+    from playerstore import PlayerStore
+    store = PlayerStore()
+    slots = [store.add('buddy-%d' % n) for n in range(30)]
+    for slot in slots[::3]:
+        store.dx[slot] = 1
+        store.elapsed[slot] = 12.5
+    report('moving()', best(store.moving, 10000))
+    report('unfinished()', best(store.unfinished, 10000))
+    report('finished()', best(store.finished, 10000))
+    for n, slot in enumerate(slots):
+        store.move(slot, 1 + 2 * (n % 10), 1)
+    report('move()', best(lambda: store.move(slots[0], 3, 1), 10000))
+    report('at()', best(lambda: store.at(3, 1), 10000))
+
+
+@benchmark
+def games():
+    """Whole games without a display: three players walk the shortest
+    way to the goal of the smallest maze, holes or not, on a made up
+    clock."""
+    from engine import Engine
+    from solver import DistanceField
+    width, height = SIZES[0]
+    mazes = [Maze(seed, width, height, 1, Maze.XORSHIFT)
+             for seed in range(100)]
+    # as the MazeBuilder hands them out
+    for maze in mazes:
+        maze.corridors()
+        maze.distance_field()
+    ticks = iter(range(1 << 62))
+
+    def play():
+        for fresh in mazes:
+            # games mark the trail and passed holes, so each starts
+            # afresh
+            maze = fresh.copy()
+            engine = Engine(maze, clock=ticks.__next__)
+            store = engine.players
+            slots = [engine.add() for n in range(3)]
+            engine.trails.update(slots)
+            way = DistanceField(maze)
+            for x, y in maze.holes:
+                way.open(x, y)
+            while not engine.over():
+                for slot in slots:
+                    if slot in engine.walking:
+                        continue
+                    direction = way.next_step(store.x[slot], store.y[slot])
+                    if direction is not None:
+                        store.dx[slot], store.dy[slot] = direction
+                        engine.walk(slot)
+                engine.tick()
+
+    report('%dx%d' % (width, height), best(play, 1) / len(mazes), 'game')
+
+
+@benchmark
+def walls():
+    """Maze.walls(): merging the walls of a maze into rectangles."""
+    for width, height in SIZES:
+        maze = Maze(0, width, height, 0, Maze.XORSHIFT)
+
+        def merge():
+            maze._walls = None
+            maze.walls()
+
+        report('%dx%d, %d rectangles' %
+               (width, height, len(maze.walls())), best(merge, 5))
+
+
+@benchmark
+def tiled():
+    """A 2001x2001 tiled maze (64x64-room tiles) on 1 to all cores."""
+    import generators
+    counts = sorted(set([1, 2, 4, os.cpu_count() or 1]))
+    for processes in counts:
+        start = time.perf_counter()
+        generators.tiled_maze(0, 2001, 2001, 64, processes)
+        report('%d processes' % processes, time.perf_counter() - start)
+
+
+@benchmark
+def can_go():
+    """Engine.can_go() from every open tile in every direction."""
+    from engine import Engine
+
+    width, height = SIZES[-1]
+    maze = Maze(0, width, height, 0)
+    engine = Engine(maze)
+    slot = engine.add()
+    cells = [(x, y) for x in range(width) for y in range(height)
+             if maze.validMove(x, y)]
+
+    def walk():
+        for x, y in cells:
+            engine.players.move(slot, x, y)
+            for direction in Maze.DIRECTIONS:
+                engine.can_go(slot, direction)
+
+    report('%dx%d' % (width, height),
+           best(walk, 3) / (len(cells) * 4))
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        function = BENCHMARKS[name]
+        print('%s: %s' % (name, function.__doc__))
+        function()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
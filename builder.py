@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import threading
+
+from gi.repository import GLib
+
+from maze import Maze
+
+
+class Cancelled(Exception):
+    """Raised inside a maze generation that is no longer wanted."""
+
+
+class MazeCache:
+    """A bounded least-recently-used cache of freshly generated mazes.
+
+    Mazes are keyed by (seed, width, height, risk, version, algorithm),
+    the arguments they were built from.  The cache keeps its own untouched
+    copy, so get() hands out a copy that can be played on.
+    """
+
+    def __init__(self, size=8):
+        self.size = size
+        self._mazes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._mazes
+
+    def get(self, key):
+        with self._lock:
+            maze = self._mazes.get(key)
+            if maze is None:
+                return None
+            self._mazes.move_to_end(key)
+        return maze.copy()
+
+    def put(self, key, maze):
+        with self._lock:
+            self._mazes[key] = maze
+            self._mazes.move_to_end(key)
+            while len(self._mazes) > self.size:
+                self._mazes.popitem(last=False)
+
+
+class MazeRequest:
+    """A maze asked for with MazeBuilder.request()."""
+
+    def __init__(self, key, callback, progress, args, search=None,
+                 error=None):
+        self.key = key
+        self.cancelled = False
+        self._callback = callback
+        self._progress = progress
+        self._args = args
+        self._search = search
+        self._error = error
+
+    def cancel(self):
+        """Stop generating the maze, and never call back for it."""
+        self.cancelled = True
+
+    def _report(self, fraction):
+        if not self.cancelled and self._progress is not None:
+            self._progress(fraction)
+        return False
+
+    def _finish(self, maze, key):
+        if not self.cancelled:
+            self.key = key
+            self._callback(maze, *self._args)
+        return False
+
+    def _fail(self):
+        if not self.cancelled and self._error is not None:
+            self._error(*self._args)
+        return False
+
+
+class MazeBuilder:
+    """Builds mazes through a MazeCache, with a worker thread that
+    generates the mazes asked for by request() and prefetch() while the
+    GTK main loop keeps running.
+
+    Requests come first: a maze being prefetched is abandoned, and
+    queued again, as soon as a request arrives.
+
+    Mazes found in one of `packs`, mazepack.MazePack files, are loaded
+    from there instead of being generated.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache if cache is not None else MazeCache()
+        self.packs = []
+        self._requests = collections.deque()
+        self._pending = collections.deque()
+        self._building = None
+        self._request = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def build(self, seed, width, height, risk, version=Maze.LEGACY,
+              algorithm=Maze.BACKTRACKER):
+        """Return a new maze, from the cache when it is there.  If the
+        worker is generating this very maze, wait for it."""
+        key = (seed, width, height, risk, version, algorithm)
+        with self._condition:
+            while self._building == key:
+                self._condition.wait()
+        maze = self.cache.get(key)
+        if maze is not None:
+            logging.debug('Maze cache hit: %s', key)
+            return maze
+        maze = self._make(key)
+        self.cache.put(key, maze)
+        return maze.copy()
+
+    def _make(self, key, progress=None):
+        maze = None
+        for pack in self.packs:
+            maze = pack.get(key)
+            if maze is not None:
+                logging.debug('Maze %s loaded from %s', key, pack.path)
+                break
+        if maze is None:
+            maze = Maze(*key, progress=progress)
+        # work out what Engine.reset() needs here, off the main loop
+        maze.corridors()
+        maze.distance_field()
+        return maze
+
+    def request(self, key, callback, progress=None, *args, search=None,
+                error=None):
+        """Generate the maze for key off the main loop.
+
+        When it is ready, callback(maze, *args) is called from the main
+        loop.  While it is generated, progress(fraction) is called from
+        the main loop too.  Any earlier request that has not finished
+        is cancelled, since this one supersedes it.
+
+        search, if given, is called first in the worker as
+        search(key, progress) and returns the key of the maze to build
+        instead, such as difficulty.SeedFinder.find() does.  The key of
+        the request becomes that key in the main loop, just before
+        callback.
+
+        If the maze cannot be built, error(*args) is called from the
+        main loop instead of callback.
+        """
+        request = MazeRequest(key, callback, progress, args, search, error)
+        with self._condition:
+            for earlier in self._requests:
+                earlier.cancel()
+            if self._request is not None:
+                self._request.cancel()
+            self._requests.clear()
+            self._requests.append(request)
+            self._start()
+            self._condition.notify_all()
+        return request
+
+    def prefetch(self, keys):
+        """Generate the mazes for these keys in the background, in
+        order, dropping what was asked for by any earlier call."""
+        with self._condition:
+            self._pending.clear()
+            for key in keys:
+                if key not in self.cache:
+                    self._pending.append(key)
+            if self._pending:
+                self._start()
+            self._condition.notify_all()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._requests and not self._pending:
+                    self._condition.wait()
+                if self._requests:
+                    request = self._requests.popleft()
+                    key = request.key
+                else:
+                    request = None
+                    key = self._pending.popleft()
+                self._building = key
+                self._request = request
+            try:
+                if request is not None:
+                    self._generate(request)
+                elif key not in self.cache:
+                    self._prefetch(key)
+            except Exception:
+                logging.exception('Generating maze %s', key)
+            finally:
+                with self._condition:
+                    self._building = None
+                    self._request = None
+                    self._condition.notify_all()
+
+    def _generate(self, request):
+        def progress(fraction):
+            if request.cancelled:
+                raise Cancelled()
+            GLib.idle_add(request._report, fraction)
+
+        key = request.key
+        try:
+            if request._search is not None:
+                key = request._search(key, progress)
+            maze = self.cache.get(key)
+            if maze is None:
+                maze = self._make(key, progress)
+                self.cache.put(key, maze)
+                maze = maze.copy()
+            else:
+                # mazes that difficulty.SeedFinder put in the cache
+                # were not made by _make()
+                maze.corridors()
+                maze.distance_field()
+        except Cancelled:
+            logging.debug('Cancelled maze %s', key)
+            return
+        except Exception:
+            logging.exception('Generating maze %s', key)
+            GLib.idle_add(request._fail)
+            return
+        GLib.idle_add(request._finish, maze, key)
+
+    def _prefetch(self, key):
+        def progress(fraction):
+            if self._requests:
+                raise Cancelled()
+
+        try:
+            self.cache.put(key, self._make(key, progress))
+        except Cancelled:
+            with self._condition:
+                self._pending.appendleft(key)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+import copy
+import itertools
+
+from maze import Maze
+
+_OPEN = bytes(Maze.PASSABLE)
+
+
+class CorridorGraph:
+    """The junctions and dead ends of a maze, and the corridors between
+    them.
+
+    Nodes are the open tiles that do not have exactly two ways out, and
+    the goal.  Each corridor is an edge: the list of the cell indices
+    of its tiles, from one node to another, both included.  For every
+    tile inside a corridor, `edge` has the number of its corridor and
+    `place` its place in the list, so run() finds where a player who
+    keeps going will stop without looking at a single wall.
+
+    A loop with no node on it, as braid mazes can have, is one edge too:
+    its tiles in order round the loop, with the number of that edge in
+    `loops`.
+    """
+
+    def __init__(self, maze):
+        self.maze = maze
+        grid = maze.map
+        cells = grid.cells.translate(_OPEN)
+        steps = [grid.offsets[d] for d in Maze.DIRECTIONS]
+        self._steps = dict(zip(steps, Maze.DIRECTIONS))
+
+        up, right, down, left = steps
+        # where Engine puts the goal, so the graph does not depend on
+        # it being there yet
+        goal = grid.index(maze.width - 2, maze.height - 2)
+        stops = bytearray(len(cells))
+        self.nodes = []
+        for i in itertools.compress(range(len(cells)), cells):
+            if cells[i + up] + cells[i + right] + cells[i + down] + \
+                    cells[i + left] != 2 or i == goal:
+                stops[i] = 1
+                self.nodes.append(i)
+
+        self.edges = []
+        self.edge = array('i', [-1]) * len(cells)
+        self.place = array('i', [0]) * len(cells)
+        for node in self.nodes:
+            for step in steps:
+                i = node + step
+                if not cells[i] or stops[i] and i < node or \
+                        self.edge[i] >= 0:
+                    # a wall, or walked from the other end already
+                    continue
+                number = len(self.edges)
+                tiles = [node]
+                previous = node
+                while not stops[i]:
+                    self.edge[i] = number
+                    self.place[i] = len(tiles)
+                    tiles.append(i)
+                    for way in steps:
+                        if cells[i + way] and i + way != previous:
+                            break
+                    i, previous = i + way, i
+                tiles.append(i)
+                self.edges.append(tiles)
+
+        self.loops = set()
+        for i in itertools.compress(range(len(cells)), cells):
+            if stops[i] or self.edge[i] >= 0:
+                continue
+            number = len(self.edges)
+            tiles = []
+            previous = None
+            while self.edge[i] < 0:
+                self.edge[i] = number
+                self.place[i] = len(tiles)
+                tiles.append(i)
+                for way in steps:
+                    if cells[i + way] and i + way != previous:
+                        break
+                i, previous = i + way, i
+            self.edges.append(tiles)
+            self.loops.add(number)
+
+    def run(self, x, y, direction):
+        """The tiles a player at (x, y) goes through when walking in
+        direction, taking the only way on at each turn, as
+        Player.keepGoing() does.  The walk ends at the next junction,
+        dead end or the goal, or in a hole that has not been passed.
+        On a loop with no junction it goes once round, back to (x, y).
+        """
+        grid = self.maze.map
+        i = grid.index(x, y)
+        j = i + grid.offsets[direction]
+        if not Maze.PASSABLE[grid.cells[j]]:
+            return []
+        number = self.edge[j]
+        if number < 0:
+            return [grid.position(j)]
+        tiles, place = self.edges[number], self.place[j]
+        if number in self.loops:
+            if tiles[place - 1] == i:
+                tiles = tiles[place:] + tiles[:place]
+            else:
+                tiles = tiles[place::-1] + tiles[:place:-1]
+        elif tiles[place - 1] == i:
+            tiles = tiles[place:]
+        else:
+            tiles = tiles[place::-1]
+        run = []
+        for i in tiles:
+            run.append(grid.position(i))
+            if grid.cells[i] == Maze.HOLE:
+                break
+        return run
+
+    def direction(self, start, end):
+        """The direction from a tile to the next one of a run."""
+        grid = self.maze.map
+        return self._steps[grid.index(*end) - grid.index(*start)]
+
+    def copy(self, maze):
+        """The same graph for a copy of its maze."""
+        graph = copy.copy(self)
+        graph.maze = maze
+        return graph
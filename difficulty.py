@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+"""How hard a maze is, measured over many seeds at once.
+
+Analyse a range of seeds on every core and keep the results:
+
+    python3 difficulty.py results.mzd 91 51 --seeds 0:10000 --risk 1
+
+and print a summary of them again later:
+
+    python3 difficulty.py results.mzd
+
+In the game, SeedFinder picks the next maze by its quick_score().
+
+The results file is made of a HEADER, with the arguments every maze was
+built with, and then blocks of up to BLOCK mazes.  A block is its
+number of mazes, as a little-endian unsigned int, then one column per
+name of COLUMNS: that many values of its array typecode, little-endian.
+"""
+
+import argparse
+from array import array
+import collections
+import logging
+import multiprocessing
+import struct
+import sys
+import threading
+import time
+
+from maze import Maze
+from solver import DistanceField
+
+# magic, width, height, risk, version, algorithm name
+HEADER = struct.Struct('<4sHHBB16s')
+MAGIC = b'MZD1'
+COUNT = struct.Struct('<I')
+BLOCK = 4096
+
+Difficulty = collections.namedtuple(
+    'Difficulty', 'solution dead_ends branching river hole_risk')
+Difficulty.__doc__ = """The difficulty of a maze.
+
+solution is the number of steps from the start to the goal, not
+minding holes.  dead_ends counts the tiles with one way out.  branching
+is the number of wrong turns there are to take per step of the
+solution.  river is the mean length of the passages leading to a dead
+end, long in twisty mazes.  hole_risk counts the holes on the
+solution."""
+
+COLUMNS = (('seed', 'q'), ('solution', 'i'), ('dead_ends', 'I'),
+           ('branching', 'f'), ('river', 'f'), ('hole_risk', 'H'))
+
+_OPEN = bytes(Maze.PASSABLE)
+
+
+def analyse(maze):
+    """Measure the Difficulty of a maze, from the top-left corner to the
+    goal in the bottom-right corner."""
+    grid = maze.map
+    cells = grid.cells.translate(_OPEN)
+    steps = [grid.offsets[d] for d in Maze.DIRECTIONS]
+    start = grid.index(1, 1)
+    goal = grid.index(maze.width - 2, maze.height - 2)
+
+    def exits(i):
+        return cells[i - 1] + cells[i + 1] + \
+            cells[i - grid.stride] + cells[i + grid.stride]
+
+    field = DistanceField(maze)
+    for x, y in maze.holes:
+        field.open(x, y)
+    path = [grid.index(x, y) for x, y in field.path(1, 1)]
+
+    wrong = sum(max(0, exits(i) - 2) for i in path[1:-1])
+    if path:
+        wrong += exits(start) - 1
+
+    dead_ends, length = 0, 0
+    for i in range(grid.origin, len(cells) - grid.origin):
+        if not cells[i] or i == start or i == goal or exits(i) != 1:
+            continue
+        dead_ends += 1
+        # walk back along the passage to the next junction
+        j, previous = i, None
+        while True:
+            following = [j + s for s in steps
+                         if cells[j + s] and j + s != previous]
+            if len(following) != 1 or j in (start, goal):
+                break
+            previous, j = j, following[0]
+            length += 1
+
+    holes = set(grid.index(x, y) for x, y in maze.holes)
+    return Difficulty(len(path) - 1, dead_ends,
+                      wrong / max(1, len(path) - 1),
+                      length / max(1, dead_ends),
+                      sum(i in holes for i in path))
+
+
+def quick_score(maze):
+    """A difficulty score that is cheap to work out: the steps of the
+    solution, not minding holes."""
+    field = DistanceField(maze)
+    for x, y in maze.holes:
+        field.open(x, y)
+    return field.distance(1, 1)
+
+
+class SeedFinder:
+    """Looks forward from a seed for the maze whose quick_score() is
+    closest to a target, within a time budget.
+
+    Scores are kept by maze key, (seed, width, height, risk, version,
+    algorithm) as in builder.MazeCache, so no maze is scored twice.
+    Mazes are taken from the MazeCache when they are there, and the
+    maze that is picked is put in it.
+    """
+
+    def __init__(self, cache=None, size=65536, budget=0.25, tolerance=0.05,
+                 limit=200):
+        self.cache = cache
+        self.size = size
+        # seconds to search for, how close to the target is close
+        # enough, and the most seeds to try
+        self.budget, self.tolerance, self.limit = budget, tolerance, limit
+        self._scores = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def score(self, key, maze=None):
+        """The quick_score() of the maze for key, built unless given."""
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+                return score
+        if maze is None:
+            maze = self._maze(key)
+        score = quick_score(maze)
+        with self._lock:
+            self._scores[key] = score
+            while len(self._scores) > self.size:
+                self._scores.popitem(last=False)
+        return score
+
+    def _maze(self, key):
+        maze = self.cache.get(key) if self.cache is not None else None
+        return maze if maze is not None else Maze(*key)
+
+    def find(self, key, target, progress=None):
+        """Return the key of the maze closest to target, trying the
+        seeds from key's onwards.  progress, if given, is called with
+        the fraction of the budget used after each seed, and may raise
+        to stop the search."""
+        start = time.monotonic()
+        best, best_miss, best_maze = None, None, None
+        for n in range(self.limit):
+            candidate = (key[0] + n,) + tuple(key[1:])
+            with self._lock:
+                known = candidate in self._scores
+            maze = None if known else self._maze(candidate)
+            miss = abs(self.score(candidate, maze) - target)
+            if best is None or miss < best_miss:
+                best, best_miss, best_maze = candidate, miss, maze
+            elapsed = time.monotonic() - start
+            if progress is not None:
+                progress(min(1.0, elapsed / self.budget))
+            if best_miss <= self.tolerance * target or \
+                    elapsed >= self.budget:
+                break
+        logging.debug('Picked maze %s, %d steps off a target of %d',
+                      best, best_miss, target)
+        if best_maze is not None and self.cache is not None:
+            self.cache.put(best, best_maze)
+        return best
+
+
+def _analyse_seed(args):
+    seed = args[0]
+    return seed, analyse(Maze(*args))
+
+
+def analyse_seeds(seeds, width, height, risk=0, version=Maze.XORSHIFT,
+                  algorithm=Maze.BACKTRACKER, processes=None, chunksize=64):
+    """Yield (seed, Difficulty) for each seed, in order, as they are
+    measured by a pool of `processes` processes, or by this one when
+    processes is 1.  Like generators.tiled_maze(), the pool uses the
+    'spawn' start method."""
+    jobs = ((seed, width, height, risk, version, algorithm)
+            for seed in seeds)
+    if processes == 1:
+        for job in jobs:
+            yield _analyse_seed(job)
+        return
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes) as pool:
+        for result in pool.imap(_analyse_seed, jobs, chunksize):
+            yield result
+
+
+def write(path, results, width, height, risk=0, version=Maze.XORSHIFT,
+          algorithm=Maze.BACKTRACKER):
+    """Stream the (seed, Difficulty) pairs of analyse_seeds() to a
+    results file, a block at a time.  Return the number written."""
+    written = 0
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, width, height, risk, version,
+                            algorithm.encode()))
+        block = []
+        for result in results:
+            block.append(result)
+            if len(block) == BLOCK:
+                written += _write_block(f, block)
+                block = []
+        if block:
+            written += _write_block(f, block)
+    return written
+
+
+def _write_block(f, block):
+    f.write(COUNT.pack(len(block)))
+    columns = [[seed for seed, _ in block]] + \
+        [list(values) for values in zip(*[d for _, d in block])]
+    for (name, typecode), values in zip(COLUMNS, columns):
+        column = array(typecode, values)
+        if sys.byteorder != 'little':
+            column.byteswap()
+        column.tofile(f)
+    return len(block)
+
+
+def read(path):
+    """Read a results file.  Return a dict of the arguments the mazes
+    were built with, and a dict of one array per name of COLUMNS."""
+    with open(path, 'rb') as f:
+        magic, width, height, risk, version, algorithm = \
+            HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('not a maze difficulty file')
+        columns = {name: array(typecode) for name, typecode in COLUMNS}
+        while True:
+            data = f.read(COUNT.size)
+            if not data:
+                break
+            count = COUNT.unpack(data)[0]
+            for name, typecode in COLUMNS:
+                column = array(typecode)
+                column.fromfile(f, count)
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                columns[name].extend(column)
+    arguments = {'width': width, 'height': height, 'risk': risk,
+                 'version': version,
+                 'algorithm': algorithm.rstrip(b'\0').decode()}
+    return arguments, columns
+
+
+def summary(arguments, columns):
+    print('%(width)dx%(height)d risk %(risk)d version %(version)d '
+          '%(algorithm)s' % arguments)
+    print('  %d mazes' % len(columns['seed']))
+    for name in Difficulty._fields:
+        values = columns[name]
+        if values:
+            print('  %-10s min %10.2f  mean %10.2f  max %10.2f' %
+                  (name, min(values), sum(values) / len(values),
+                   max(values)))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path', help='results file')
+    parser.add_argument('width', type=int, nargs='?',
+                        help='analyse mazes this wide into path')
+    parser.add_argument('height', type=int, nargs='?')
+    parser.add_argument('--seeds', default='0:1000',
+                        help='first:last seed, last excluded')
+    parser.add_argument('--risk', type=int, default=0)
+    parser.add_argument('--version', type=int, default=Maze.XORSHIFT)
+    parser.add_argument('--algorithm', default=Maze.BACKTRACKER)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.width is not None:
+        if args.height is None:
+            parser.error('the height is missing')
+        first, last = [int(n) for n in args.seeds.split(':')]
+        results = analyse_seeds(range(first, last), args.width,
+                                args.height, args.risk, args.version,
+                                args.algorithm, args.processes)
+        write(args.path, results, args.width, args.height, args.risk,
+              args.version, args.algorithm)
+    summary(*read(args.path))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from maze import Maze
+from playerstore import PlayerStore
+
+# a falling player shrinks from the tile size, in pixels, and is back at
+# the start once it is this small
+FALL_END = 20
+
+
+def falling_sizes(tile_size):
+    """The sizes a player falling through a hole has on each step, in
+    pixels, from the step into the hole on."""
+    step = max(1, int(tile_size / 4))
+    return list(range(tile_size, FALL_END, -step))
+
+
+class Engine:
+    """The rules of the game: walking, holes, the goal, timing and who
+    finished first, for the players of a PlayerStore.
+
+    Nothing here draws or talks to peers, so games can be played
+    without a display, as fast as the rules go.  Times come from clock,
+    time.time unless given, so they can be made up too.  game.MazeGame
+    shows an Engine and feeds it the moves of the players.
+    """
+
+    # the falling animation counts down from the tile size, in pixels
+    TILE_SIZE = 40
+
+    def __init__(self, maze=None, clock=time.time, store=None):
+        self.clock = clock
+        self.players = store if store is not None else PlayerStore()
+        self.tile_size = self.TILE_SIZE
+        # when the game started, which peers agree on, see running_time()
+        self.start_time = clock()
+        # called with the slot of each player reaching the goal
+        self.on_finish = None
+        # the slots of players leaving a trail, and of players hidden
+        # again when they go back to the start, such as bonus players
+        self.trails = set()
+        self.spares = set()
+        # the slots walking or falling, stepped together by tick()
+        self.walking = []
+        # for each slot, the tile its route left it on and the tiles left
+        # to walk through, last first
+        self._routes = {}
+        self.maze = maze
+        if maze is not None:
+            self.reset()
+
+    def reset(self):
+        """Start self.maze over: everyone in the top-left, and the goal
+        in the bottom-right corner."""
+        self.level_start_time = self.clock()
+        self.finish_time = None
+        self.walking = []
+        for slot in self.players.slots():
+            self.reset_player(slot)
+        maze = self.maze
+        maze.map.set(maze.width - 2, maze.height - 2, Maze.GOAL)
+        # the way to the goal from everywhere, and where each corridor
+        # leads, kept with the maze so a restart does not work them out
+        # again
+        self.solver = maze.distance_field()
+        self.corridors = maze.corridors()
+
+    def running_time(self):
+        return self.clock() - self.start_time
+
+    def add(self, uid=None, hidden=False):
+        """A new player, standing at the start.  Return its slot."""
+        return self.players.add(uid, hidden)
+
+    def remove(self, slot):
+        self.trails.discard(slot)
+        self.spares.discard(slot)
+        self._routes.pop(slot, None)
+        self.walking = [walker for walker in self.walking if walker != slot]
+        self.players.remove(slot)
+
+    def reset_player(self, slot):
+        self.players.reset(slot)
+        self._routes.pop(slot, None)
+        if slot in self.spares:
+            self.players.hidden[slot] = 1
+
+    def walk(self, slot, change_direction=True):
+        """Take a step now.  With change_direction the player then keeps
+        walking on each tick() as long as the way on is obvious.
+        Return the tiles that changed, as step() does."""
+        changed = self.step(slot, change_direction)
+        if changed and change_direction and slot not in self.walking:
+            if self.players.dx[slot] or self.players.dy[slot] or \
+                    self.players.falling[slot]:
+                self.walking.append(slot)
+        return changed
+
+    def tick(self):
+        """Step every walking player.  Return the tiles that changed."""
+        changed = []
+        for slot in list(self.walking):
+            changed.extend(self.step(slot))
+        dx, dy, falling = \
+            self.players.dx, self.players.dy, self.players.falling
+        self.walking = [slot for slot in self.walking
+                        if dx[slot] or dy[slot] or falling[slot]]
+        return changed
+
+    def step(self, slot, change_direction=True):
+        """Move a player one step, falling into holes and finishing at
+        the goal.  Return the tiles that changed: where the player was
+        and where it is now, or none when nothing happened."""
+        store = self.players
+        old = (store.x[slot], store.y[slot])
+        if not self._animate(slot, change_direction):
+            return []
+        new = (store.x[slot], store.y[slot])
+        if old != new:
+            maze = self.maze
+            # fall into hole
+            if maze.map.get(*new) == Maze.HOLE:
+                store.falling[slot] = self.tile_size
+                maze.map.set(new[0], new[1], Maze.PASSED)
+                self.solver.open(*new)
+
+            if slot in self.trails:
+                # mark the trail
+                px, py = store.px[slot], store.py[slot]
+                if maze.map.get(px, py) != Maze.PASSED:
+                    maze.map.set(px, py, Maze.SEEN)
+                # detect the move into goal
+                if maze.map.get(*new) == Maze.GOAL:
+                    self.finish(slot)
+        return [old, new]
+
+    def _animate(self, slot, change_direction):
+        store = self.players
+        # if player is falling
+        if store.falling[slot] > 0:
+            store.falling[slot] -= max(1, int(self.tile_size / 4))
+            if store.falling[slot] <= FALL_END:
+                self.reset_player(slot)
+            return True
+
+        tile = self.maze.map.get(store.x[slot], store.y[slot])
+
+        # if the player finished the maze, then don't move
+        if tile == Maze.GOAL:
+            store.dx[slot] = store.dy[slot] = 0
+            return False
+
+        if tile == Maze.HOLE:
+            store.dx[slot] = store.dy[slot] = 0
+            return True
+
+        if change_direction:
+            return self.follow(slot)
+
+        direction = (store.dx[slot], store.dy[slot])
+        if self.can_go(slot, direction):
+            self.move(slot, direction)
+            return True
+
+        store.dx[slot] = store.dy[slot] = 0
+        return False
+
+    def follow(self, slot):
+        """Take the next step of the player's route along the corridor,
+        starting a new route when the player was turned or moved off
+        it, such as by a peer's move: message."""
+        store = self.players
+        x, y = store.x[slot], store.y[slot]
+        dx, dy = store.dx[slot], store.dy[slot]
+        at, route = self._routes.get(slot, (None, None))
+        if not route or at != (x, y) or route[-1] != (x + dx, y + dy):
+            if (dx, dy) == (0, 0):
+                return False
+            route = self.corridors.run(x, y, (dx, dy))[::-1]
+            if not route:
+                self._routes.pop(slot, None)
+                store.dx[slot] = store.dy[slot] = 0
+                return False
+        store.px[slot], store.py[slot] = x, y
+        position = route.pop()
+        store.move(slot, *position)
+        self._routes[slot] = (position, route)
+        if route:
+            store.dx[slot], store.dy[slot] = \
+                self.corridors.direction(position, route[-1])
+        else:
+            store.dx[slot] = store.dy[slot] = 0
+        return True
+
+    def move(self, slot, direction):
+        """Move the player in a given direction (deltax, deltay)."""
+        store = self.players
+        x, y = store.x[slot], store.y[slot]
+        store.px[slot], store.py[slot] = x, y
+        store.move(slot, x + direction[0], y + direction[1])
+
+    def can_go(self, slot, direction):
+        """Can the player go in this direction without bumping into
+        something?"""
+        return self.maze.validMove(self.players.x[slot] + direction[0],
+                                   self.players.y[slot] + direction[1])
+
+    def keep_going(self, slot, direction):
+        """Keep going if the way on from direction is obvious, else
+        stop.  This is what follow() does a corridor at a time."""
+        # possible directions are fwd, turn left, turn right
+        directions = [d for d in (direction, (direction[1], direction[0]),
+                                  (-direction[1], -direction[0]))
+                      if self.can_go(slot, d)]
+        store = self.players
+        # is there only one possible direction?
+        if len(directions) == 1:
+            store.dx[slot], store.dy[slot] = directions[0]
+        else:
+            store.dx[slot] = store.dy[slot] = 0
+
+    def finish(self, slot):
+        """The player reached the goal: note the time it took."""
+        self.finish_time = self.clock()
+        self.players.elapsed[slot] = self.finish_time - self.level_start_time
+        if self.on_finish is not None:
+            self.on_finish(slot)
+
+    def award(self, slot):
+        """Count a victory for the player if no one finished faster.
+        Return whether it did."""
+        store = self.players
+        if store.elapsed[slot] <= store.elapsed[store.finished()[0]]:
+            store.victories[slot] += 1
+            return True
+        return False
+
+    def over(self):
+        """Whether every player shown reached the goal."""
+        return not self.players.unfinished()
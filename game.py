@@ -23,9 +23,11 @@
 #     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import functools
+import glob
+import os
 import sys
 import time
-from math import pi
 from gi.repository import GLib
 from gi.repository import Gdk
 from gi.repository import Gtk
@@ -39,14 +41,21 @@ from sugar3.graphics.icon import Icon
 from sugar3.graphics.xocolor import XoColor
 from sugar3.graphics.toolbutton import ToolButton
 
+from builder import MazeBuilder
+from difficulty import SeedFinder
+from engine import Engine
+import generators
 from maze import Maze, Rectangle
+from mazepack import MazePack
 from player import Player
+from render import TileAtlas
 import sensors
 
 
 class MazeGame(Gtk.DrawingArea):
     """Maze game controller.
-    This class handles all of the game logic, event loop, mulitplayer, etc."""
+    This class shows an engine.Engine, which has the rules of the game,
+    and handles the event loop, multiplayer, etc."""
 
     # Munsell neutrals http://wiki.laptop.org/go/Munsell
     EMPTY_COLOR = (203.0 / 256.0, 203.0 / 256.0, 203.0 / 256.0)
@@ -59,7 +68,16 @@ class MazeGame(Gtk.DrawingArea):
         else:
             self.EMPTY_COLOR = (203.0 / 256.0, 203.0 / 256.0, 203.0 / 256.0)
             self.SOLID_COLOR = (28.0 / 256.0, 28.0 / 256.0, 28.0 / 256.0)
-        self._recalculate_sizes(self.get_allocation())
+        # the players are the same in any theme
+        self._dirty_layers.update(('maze', 'marks'))
+        self.redraw()
+
+    # walking steps per second, see set_tick_rate()
+    TICK_RATE = 10
+
+    # how much harder() and easier() change the difficulty score when
+    # they pick mazes by difficulty, see set_targeted()
+    TARGET_STEP = 1.15
 
     GOAL_COLOR = (0.0, 1.0, 0.0)
     HOLE_COLOR = (1.0, 0.0, 0.0)
@@ -68,25 +86,37 @@ class MazeGame(Gtk.DrawingArea):
     def __init__(self, activity):
         super().__init__()
 
-        # note what time it was when we first launched
-        self.game_start_time = time.time()
-
         # the activity is used to communicate with other players
         self._activity = activity
 
+        # the rules of the game, which note what time it was when we
+        # first launched
+        self.engine = Engine()
+        self.engine.on_finish = self.__finish_cb
+
+        # the state of every player, see Player
+        self.players = self.engine.players
+
         # keep a list of all local players
         self.localplayers = []
 
-        # start with just one player
-        player = Player(activity.owner)
+        # start with just one player, the bonus players join the first
+        # time their keys are pressed
+        player = Player(activity.owner, self.players)
+        self.engine.trails.add(player.slot)
         self.localplayers.append(player)
-        # plus some bonus players (all hidden to start with)
-        self.localplayers.extend(player.bonusPlayers())
 
         # keep a dictionary of all remote players, indexed by handle
         self.remoteplayers = {}
+        # the maze versions each remote player announced, by handle
+        self._remote_versions = {}
+        # and the maze algorithms, see generators.ENGINES
+        self._remote_algorithms = {}
         # keep a list of all players, local and remote,
         self.allplayers = [] + self.localplayers
+        # and each of them by slot, to draw the players the store finds
+        # on a tile
+        self._by_slot = {player.slot: player for player in self.allplayers}
 
         screen = Gdk.Screen.get_default()
         self.aspectRatio = float(screen.width()) / screen.height()
@@ -100,22 +130,53 @@ class MazeGame(Gtk.DrawingArea):
             if width % 2 == 0:
                 width -= 1
             state = {'seed': int(time.time()),
-                     'height': height, 'width': width, 'risk': 0}
+                     'height': height, 'width': width, 'risk': 0,
+                     'version': Maze.VERSIONS[-1],
+                     'algorithm': Maze.BACKTRACKER}
 
         if 'finish_time' in state and state['finish_time'] is not None:
             # the maze was alread played, reset it to start a new one
             state['seed'] = int(time.time())
+            state['version'] = Maze.VERSIONS[-1]
 
         logging.debug('Starting the game with: %s', state)
-        self.maze = Maze(state['seed'], state['width'], state['height'],
-                         state['risk'])
+        # the algorithm new mazes are built with, when everyone has it
+        self.algorithm = state.get('algorithm', Maze.BACKTRACKER)
+        self._builder = MazeBuilder()
+        # packs of ready made mazes, see mazepack.py
+        for path in sorted(glob.glob(os.path.join(
+                activity.get_activity_root(), 'data', '*.mzk'))):
+            try:
+                self._builder.packs.append(MazePack(path))
+            except (OSError, ValueError):
+                logging.exception('Opening maze pack %s', path)
+        self._maze_request = None
+        # the last move: or step: of each remote player received while
+        # _maze_request is generated, replayed on the new maze
+        self._held_moves = {}
+        # steps the players walking or falling, see Engine.tick()
+        self._tick_id = None
+        self.tick_rate = state.get('tick_rate', self.TICK_RATE)
+        # whether new mazes are picked by their difficulty score
+        self.targeted = state.get('targeted', False)
+        self._finder = SeedFinder(self._builder.cache)
+        self.engine.maze = self._builder.build(
+            state['seed'], state['width'], state['height'], state['risk'],
+            state.get('version', Maze.LEGACY), self.algorithm)
         self._ebook_mode_detector = sensors.EbookModeDetector()
         self._finish_window = None
+        # the tiles redraw() copies, made again when their size or
+        # colours change
+        self._atlas = None
+        self._atlas_key = None
+        # the maze, marks and sprites layers, see __draw_cb(), and the
+        # mark of each cell as it is on the marks layer
+        self._layers = None
+        self._marks = None
         self.reset()
 
         self.frame = 0
         self._show_trail = True
-        self._cached_surface = None
 
         # support arrow keys, game pad arrows and game pad buttons
         # each set maps to a local player index and a direction
@@ -159,47 +220,138 @@ class MazeGame(Gtk.DrawingArea):
         self._ebook_mode_detector.connect('changed',
                                           self._ebook_mode_changed_cb)
 
+    @property
+    def maze(self):
+        return self.engine.maze
+
+    @property
+    def finish_time(self):
+        return self.engine.finish_time
+
     def __configure_cb(self, event):
         ''' Screen size has changed '''
         width = Gdk.Screen.get_default().width()
         height = Gdk.Screen.get_default().height() - style.GRID_CELL_SIZE
         self.aspectRatio = width / height
 
-        self._activity.busy()
-        if width < height:
-            if self.maze.width < self.maze.height:
-                self.maze = Maze(self.maze.seed + 1, self.maze.width,
-                                 self.maze.height, self.maze.risk)
-            else:
-                self.maze = Maze(self.maze.seed + 1, self.maze.height,
-                                 self.maze.width, self.maze.risk)
+        seed, mazeWidth, mazeHeight, risk = self._maze_key()[:4]
+        if (width < height) == (mazeWidth < mazeHeight):
+            newWidth, newHeight = mazeWidth, mazeHeight
         else:
-            if self.maze.width > self.maze.height:
-                self.maze = Maze(self.maze.seed + 1, self.maze.width,
-                                 self.maze.height, self.maze.risk)
-            else:
-                self.maze = Maze(self.maze.seed + 1, self.maze.height,
-                                 self.maze.width, self.maze.risk)
-        if len(self.remoteplayers) > 0:
-            self.game_start_time -= 10
+            newWidth, newHeight = mazeHeight, mazeWidth
+        self._load_maze(self._new_key(seed + 1, newWidth, newHeight, risk),
+                        announce=True)
+
+    def _maze_key(self):
+        """The (seed, width, height, risk, version, algorithm) of the
+        maze being played, or of the maze being generated to replace
+        it."""
+        if self._maze_request is not None:
+            return self._maze_request.key
+        return (self.maze.seed, self.maze.width, self.maze.height,
+                self.maze.risk, self.maze.version, self.maze.algorithm)
+
+    def _new_key(self, seed, width, height, risk):
+        """The key of a new maze that every player can build."""
+        version = self.maze_version()
+        if version == Maze.LEGACY:
+            return (seed, width, height, risk, version, Maze.BACKTRACKER)
+        return (seed, width, height, risk, version, self.maze_algorithm())
+
+    def _load_maze(self, key, passed=(), announce=False, scale=None):
+        """Generate a maze off the main loop and play it once it is
+        ready, giving up any maze still being generated.  passed are
+        holes to mark as passed, announce sends the maze to peers.
+        With a scale, the maze is the one from key's seed onwards whose
+        score is nearest to scale times that of the maze being played,
+        or being generated to replace it, so peers are sent the seed
+        that was picked."""
+        search = None
+        if scale is not None:
+            search = functools.partial(self._find_seed, self._maze_key(),
+                                       scale)
+        if self._maze_request is None:
+            self._activity.busy()
+        else:
+            self._maze_request.cancel()
+        self._maze_request = self._builder.request(
+            key, self.__maze_ready_cb, self._activity.show_progress,
+            passed, announce, search=search, error=self.__maze_failed_cb)
+
+    def _find_seed(self, base, scale, key, progress):
+        # runs in the MazeBuilder worker
+        target = self._finder.score(base) * scale
+        return self._finder.find(key, target, progress)
+
+    def __maze_ready_cb(self, maze, passed, announce):
+        self._maze_request = None
+        self._activity.show_progress(None)
+        self.engine.maze = maze
+        # mark passed holes
+        for x, y in passed:
+            self.maze.map.set(x, y, self.maze.PASSED)
+            self.maze.distance_field().open(x, y)
+        # tell everyone which maze we are playing, so they can sync up
+        if announce and len(self.remoteplayers) > 0:
+            # but fudge it a little so that we can be sure they'll use our maze
+            self.engine.start_time -= 10
             self._send_maze()
         self._activity.unbusy()
         self.reset()
+        self._replay_moves()
+
+    def __maze_failed_cb(self, passed, announce):
+        # keep playing the maze we have
+        self._maze_request = None
+        self._activity.show_progress(None)
+        self._activity.unbusy()
+        self._replay_moves()
+
+    def _replay_moves(self):
+        """Apply the moves held while a maze was generated, once
+        everyone is at the start of it.  They were sent for the maze
+        the peer had then, so any that lands in a wall here is left
+        out."""
+        held, self._held_moves = self._held_moves, {}
+        for player, message in held.items():
+            if player not in self.allplayers:
+                continue
+            try:
+                x, y = [int(v) for v in message[5:].split(",")[:2]]
+                if not self.maze.validMove(x, y):
+                    logging.debug('Dropping held move: %s', message)
+                    continue
+                self.handleMessage(player, message)
+            except BaseException:
+                logging.error("Error handling message: %s\n%s",
+                              message, sys.exc_info())
+
+    def maze_version(self):
+        """The newest maze version that every player can build.
+        Peers that never announced their versions are running an old
+        Maze, which only knows the legacy generator."""
+        versions = set(Maze.VERSIONS)
+        for key in self.remoteplayers:
+            versions &= self._remote_versions.get(key, {Maze.LEGACY})
+        return max(versions)
+
+    def maze_algorithm(self):
+        """self.algorithm if every player has it, else the backtracker,
+        which every Maze has."""
+        for key in self.remoteplayers:
+            if self.algorithm not in self._remote_algorithms.get(
+                    key, {Maze.BACKTRACKER}):
+                return Maze.BACKTRACKER
+        return self.algorithm
 
     def game_running_time(self, newelapsed=None):
-        return time.time() - self.game_start_time
+        return self.engine.running_time()
 
     def reset(self):
         """Reset the game state.  Everyone starts in the top-left.
         The goal starts in the bottom-right corner."""
-        self.running = True
-        self.level_start_time = time.time()
-        self.finish_time = None
-        for player in self.allplayers:
-            player.reset()
+        self.engine.reset()
         self._dirty_points = []
-        self.maze.map[self.maze.width - 2][self.maze.height - 2] = \
-            self.maze.GOAL
 
         # force size recalcuation
         self._recalculate_sizes(self.get_allocation())
@@ -210,6 +362,7 @@ class MazeGame(Gtk.DrawingArea):
             self._start_accelerometer()
         self.close_finish_window()
         self.grab_focus()
+        self._prefetch()
 
     def __size_allocate_cb(self, widget, allocation):
         self._recalculate_sizes(allocation)
@@ -227,123 +380,122 @@ class MazeGame(Gtk.DrawingArea):
                                 self.tileSize * self.maze.width,
                                 self.tileSize * self.maze.height)
         self.outline = int(self.tileSize / 5)
-        self._cached_surface = None
+        self.engine.tile_size = self.tileSize
+        self._layers = None
         self.queue_draw()
-        self._dirty_rect = self.maze.bounds
+        self._dirty_layers = set(('maze', 'marks', 'sprites'))
 
     def __draw_cb(self, widget, ctx):
         """ Draw part of the widget. """
 
-        # on first signal, create a cached surface and draw onto it
-        if self._cached_surface is None:
-            self._cached_surface = ctx.get_target().create_similar(
-                cairo.CONTENT_COLOR_ALPHA, self._width, self._height)
-            self._ctx = cairo.Context(self._cached_surface)
+        # on first signal, create the layers and draw onto them: the
+        # maze, the marks that change on it while playing, and the
+        # players
+        if self._layers is None:
+            target = ctx.get_target()
+            self._layers = [
+                target.create_similar(content, self._width, self._height)
+                for content in (cairo.CONTENT_COLOR,
+                                cairo.CONTENT_COLOR_ALPHA,
+                                cairo.CONTENT_COLOR_ALPHA)]
+            self._dirty_layers = set(('maze', 'marks', 'sprites'))
             self.redraw()
 
-        # paint only the part of the surface that GTK tells us to
-        ctx.set_source_surface(self._cached_surface)
-        ctx.paint()
+        # paint only the part of the layers that GTK tells us to, one
+        # over the other
+        for layer in self._layers:
+            ctx.set_source_surface(layer)
+            ctx.paint()
 
     def redraw(self):
-        """ Redraw the dirty parts of the maze, to reduce CPU load. """
+        """ Redraw the dirty parts of the maze, to reduce CPU load.
+        Whole layers are drawn again when they are in _dirty_layers,
+        else only the tiles of _dirty_points are. """
 
-        if self._cached_surface is None:
+        if self._layers is None:
             return
 
-        if self._dirty_rect is None and len(self._dirty_points) == 0:
+        if not self._dirty_layers and len(self._dirty_points) == 0:
             return
 
-        def drawPoint(x, y):
-            rect = Rectangle(self.bounds.x + x * self.tileSize,
-                             self.bounds.y + y * self.tileSize,
-                             self.tileSize, self.tileSize)
-            tile = self.maze.map[x][y]
-
-            if tile == self.maze.HOLE:
-                line_width = self.tileSize / 32.
-                center = self.tileSize / 2
-                self._ctx.save()
-                self._ctx.set_source_rgb(*self.EMPTY_COLOR)
-                self._ctx.rectangle(*rect.get_bounds())
-                self._ctx.fill()
-                self._ctx.arc(rect.x + center, rect.y + center,
-                              center - line_width, 0, 2 * pi)
-                self._ctx.save()
-                self._ctx.set_source_rgb(*self.HOLE_COLOR)
-                self._ctx.set_line_width(line_width)
-                self._ctx.fill_preserve()
-                self._ctx.set_source_rgba(*self.SOLID_COLOR)
-                self._ctx.stroke()
-            else:
-                bg = {
-                    self.maze.SOLID: self.SOLID_COLOR,
-                    self.maze.EMPTY: self.EMPTY_COLOR,
-                    self.maze.SEEN: self.EMPTY_COLOR,
-                    self.maze.GOAL: self.GOAL_COLOR,
-                    self.maze.PASSED: self.PASSED_COLOR
-                }
-                self._ctx.save()
-                self._ctx.set_source_rgb(*bg[tile])
-                self._ctx.rectangle(*rect.get_bounds())
-                self._ctx.fill()
-
-            if self._show_trail:
-                if tile == self.maze.SEEN:
-                    radius = self.tileSize / 3 - self.outline
-                    center = self.tileSize / 2
-                    self._ctx.set_source_rgba(
-                        *self.localplayers[0].bg.get_rgba())
-                    self._ctx.arc(rect.x + center, rect.y + center,
-                                  radius, 0, 2 * pi)
-                    self._ctx.fill()
-            self._ctx.restore()
-
-        # re-draw the dirty rectangle
-        if self._dirty_rect is not None:
-
-            # background
-            self._ctx.save()
-            self._ctx.rectangle(0, 0, self._width, self._height)
-            self._ctx.set_source_rgb(*self.SOLID_COLOR)
-            self._ctx.fill()
-            self._ctx.restore()
-
-            # compute the area that needs to be redrawn
-            left = max(0, self._dirty_rect.x)
-            right = min(self.maze.width,
-                        self._dirty_rect.x + self._dirty_rect.width)
-            top = max(0, self._dirty_rect.y)
-            bottom = min(self.maze.height,
-                         self._dirty_rect.y + self._dirty_rect.height)
-
-            # loop over the dirty rect and draw
-            for x in range(left, right):
-                for y in range(top, bottom):
-                    drawPoint(x, y)
-
-        # re-draw the dirty points
-        for x, y in self._dirty_points:
-            drawPoint(x, y)
+        atlas_key = (self.tileSize, self.SOLID_COLOR, self.EMPTY_COLOR)
+        if atlas_key != self._atlas_key:
+            colors = {self.maze.SOLID: self.SOLID_COLOR,
+                      self.maze.EMPTY: self.EMPTY_COLOR,
+                      self.maze.GOAL: self.GOAL_COLOR,
+                      self.maze.HOLE: self.HOLE_COLOR,
+                      self.maze.PASSED: self.PASSED_COLOR}
+            self._atlas = TileAtlas(self._layers[0], self.tileSize, colors,
+                                    self.localplayers[0].bg.get_rgba())
+            self._atlas_key = atlas_key
+
+        grid = self.maze.map
+        points = set(self._dirty_points)
+        maze_layer, marks_layer, sprites_layer = \
+            [cairo.Context(layer) for layer in self._layers]
+
+        if 'maze' in self._dirty_layers:
+            maze_layer.set_source_rgb(*self.SOLID_COLOR)
+            maze_layer.paint()
+            self._atlas.paint_floor(maze_layer, grid, self.bounds.x,
+                                    self.bounds.y)
+
+        if 'marks' in self._dirty_layers:
+            marks_layer.set_operator(cairo.OPERATOR_CLEAR)
+            marks_layer.paint()
+            marks_layer.set_operator(cairo.OPERATOR_OVER)
+            self._marks = bytearray(self._atlas.paint_marks(
+                marks_layer, grid, self.bounds.x, self.bounds.y,
+                self._show_trail))
+        else:
+            # only the tiles whose mark changed
+            for x, y in points:
+                i = grid.index(x, y)
+                mark = self._atlas.mark(grid.cells[i], self._show_trail)
+                if mark != self._marks[i]:
+                    self._atlas.paint_mark(
+                        marks_layer, mark, self.bounds.x + x * self.tileSize,
+                        self.bounds.y + y * self.tileSize)
+                    self._marks[i] = mark
+
+        if 'sprites' in self._dirty_layers:
+            sprites_layer.set_operator(cairo.OPERATOR_CLEAR)
+            sprites_layer.paint()
+            players = [player for player in self.allplayers
+                       if not player.hidden]
+        else:
+            # clear the dirty tiles, and draw the players standing on them
+            sprites_layer.set_operator(cairo.OPERATOR_CLEAR)
+            players = []
+            for x, y in points:
+                sprites_layer.rectangle(self.bounds.x + x * self.tileSize,
+                                        self.bounds.y + y * self.tileSize,
+                                        self.tileSize, self.tileSize)
+                players.extend(self._by_slot[slot]
+                               for slot in self.players.at(x, y))
+            sprites_layer.fill()
+        sprites_layer.set_operator(cairo.OPERATOR_OVER)
 
         main_player = self.localplayers[0]
-        # draw all players
-        for player in self.allplayers:
-            if not player.hidden and player != main_player:
-                player.draw(self._ctx, self.bounds, self.tileSize,
+        for player in players:
+            if player != main_player:
+                player.draw(sprites_layer, self.bounds, self.tileSize,
                             self.HOLE_COLOR)
         # draw last the main player
-        main_player.draw(self._ctx, self.bounds, self.tileSize,
-                         self.HOLE_COLOR)
-
-        # clear the dirty rect so nothing will be drawn until there is a change
-        self._dirty_rect = None
+        if main_player in players:
+            main_player.draw(sprites_layer, self.bounds, self.tileSize,
+                             self.HOLE_COLOR)
+
+        if self._dirty_layers:
+            self.queue_draw()
+        # nothing will be drawn until there is a change
+        self._dirty_layers = set()
         self._dirty_points = []
 
     def set_show_trail(self, show_trail):
         if self._show_trail != show_trail:
             self._show_trail = show_trail
-            self._dirty_rect = self.maze.bounds
+            self._dirty_layers.add('marks')
             self.redraw()
             return True
         else:
@@ -378,7 +530,7 @@ class MazeGame(Gtk.DrawingArea):
             y = 0
 
         player = self.localplayers[0]
-        player.hidden = False
+        self._show(player)
         if abs(x) > abs(y):
             if x > 0:
                 # RIGHT
@@ -443,7 +595,7 @@ class MazeGame(Gtk.DrawingArea):
                 if ((abs(mouse_movement[0]) > 10) or
                         (abs(mouse_movement[1]) > 10)):
                     player = self.localplayers[0]
-                    player.hidden = False
+                    self._show(player)
                     # x movement larger
                     if abs(mouse_movement[0]) > abs(mouse_movement[1]):
                         if mouse_movement[0] > 0:
@@ -475,8 +627,8 @@ class MazeGame(Gtk.DrawingArea):
             self.easier()
         elif key_name in self.arrowkeys:
             playernum, direction = self.arrowkeys[key_name]
-            player = self.localplayers[playernum]
-            player.hidden = False
+            player = self._local_player(playernum)
+            self._show(player)
 
             if direction == 'Up':
                 player.direction = (0, -1)
@@ -492,54 +644,75 @@ class MazeGame(Gtk.DrawingArea):
                 self._send_move(player)
             self.player_walk(player)
 
+    def _local_player(self, number):
+        """Local player number 0, 1 or 2, bringing in the bonus players
+        when one of them is first wanted."""
+        if number >= len(self.localplayers):
+            bonusplayers = self.localplayers[0].bonusPlayers()
+            for player in bonusplayers:
+                player.reset()
+                self.engine.trails.add(player.slot)
+                self.engine.spares.add(player.slot)
+            self.localplayers.extend(bonusplayers)
+            self.allplayers.extend(bonusplayers)
+            self._by_slot.update((player.slot, player)
+                                 for player in bonusplayers)
+        return self.localplayers[number]
+
+    def _show(self, player):
+        """Show a hidden player, drawing it on the next redraw."""
+        if player.hidden:
+            player.hidden = False
+            self._mark_point_dirty(player.position)
+
     def player_walk(self, player, change_direction=True):
-        oldposition = player.position
-        update, newposition = player.animate(
-            self.maze, self.tileSize, change_direction)
-        if update:
-            self._mark_point_dirty(oldposition)
-            self._mark_point_dirty(newposition)
-            if oldposition != newposition:
-
-                # fall into hole
-                nx, ny = newposition
-                if self.maze.map[nx][ny] == self.maze.HOLE:
-                    player.fallThroughHole(self.tileSize)
-                    self._mark_point_dirty((0, 0))
-                    self.maze.map[nx][ny] = self.maze.PASSED
-
-                if player in self.localplayers:
-                    # mark my trail
-                    px, py = (player.previous[0], player.previous[1])
-                    if self.maze.map[px][py] != self.maze.PASSED:
-                        self.maze.map[px][py] = self.maze.SEEN
-                    # detect my move into goal
-                    if self.maze.map[nx][ny] == self.maze.GOAL:
-                        self.finish(player)
+        """Take a step now.  With change_direction the player then keeps
+        walking, one step per tick, as long as the way on is obvious;
+        otherwise this was a single step, sent to peers."""
+        changed = self.engine.walk(player.slot, change_direction)
+        if changed:
+            for point in changed:
+                self._mark_point_dirty(point)
             self.redraw()
-
             if change_direction:
-                if player.direction != (0, 0):
-                    GLib.timeout_add(100, self.player_walk, player)
-            else:
+                if self.engine.walking and self._tick_id is None:
+                    self._tick_id = GLib.timeout_add(
+                        int(1000 / self.tick_rate), self._tick)
+            elif len(self.remoteplayers) > 0 and \
+                    player == self.localplayers[0]:
                 # if we have peers and the player is the main local player
-                if len(self.remoteplayers) > 0 and \
-                        player == self.localplayers[0]:
-                    self._activity.broadcast_msg(
-                        "step:%d,%d,%d,%d" %
-                        (player.position[0], player.position[1],
-                         player.direction[0], player.direction[1]))
+                self._activity.broadcast_msg(
+                    "step:%d,%d,%d,%d" %
+                    (player.position[0], player.position[1],
+                     player.direction[0], player.direction[1]))
+
+    def _tick(self):
+        """Step every walking player, then draw all they changed at
+        once.  The timer stops while nobody walks."""
+        for point in self.engine.tick():
+            self._mark_point_dirty(point)
+        self.redraw()
+        if self.engine.walking:
+            return True
+        self._tick_id = None
         return False
 
+    def set_tick_rate(self, rate):
+        """Walk rate steps per second."""
+        self.tick_rate = rate
+        if self._tick_id is not None:
+            GLib.source_remove(self._tick_id)
+            self._tick_id = GLib.timeout_add(int(1000 / rate), self._tick)
+
     def buddy_joined(self, buddy):
         if buddy:
             logging.debug("Join: %s - %s", buddy.props.nick,
                           buddy.props.color)
-            player = Player(buddy)
+            player = Player(buddy, self.players)
             player.uid = buddy.props.key
             self.remoteplayers[buddy.props.key] = player
             self.allplayers.append(player)
-            self.allplayers.extend(player.bonusPlayers())
+            self._by_slot[player.slot] = player
             self._mark_point_dirty(player.position)
 
     def _send_move(self, player):
@@ -554,16 +727,36 @@ class MazeGame(Gtk.DrawingArea):
                                        self.maze.height, self.maze.risk)
 
         passed = self.maze.get_passed()
-        if passed:
+        if passed or self.maze.version != Maze.LEGACY:
             msg += ',%d' % len(passed)
             for hole in passed:
                 msg += ',%d,%d' % hole
+        if self.maze.version != Maze.LEGACY:
+            msg += ',%d' % self.maze.version
+        if self.maze.algorithm != Maze.BACKTRACKER:
+            msg += ',%s' % self.maze.algorithm
 
         self._activity.broadcast_msg(msg)
 
+    def send_versions(self):
+        """Tell the other players which maze versions and algorithms we
+        can build."""
+        self._activity.broadcast_msg(
+            "versions:" + ",".join(str(v) for v in Maze.VERSIONS))
+        self._activity.broadcast_msg(
+            "algorithms:" + ",".join(generators.ENGINES))
+
     def _handle_req_maze(self, player):
-        # tell them which maze we are playing, so they can sync up
-        self._send_maze()
+        self.send_versions()
+        # a player who can't build our maze has joined, so switch to
+        # the same maze built by a generator that everyone has
+        key = self._new_key(*self._maze_key()[:4])
+        if self._maze_key()[4] > key[4] or \
+                self._maze_key()[5] not in (key[5], Maze.BACKTRACKER):
+            self._load_maze(key, announce=True)
+        else:
+            # tell them which maze we are playing, so they can sync up
+            self._send_maze()
         # only the first player collaborate
         player = self.localplayers[0]
         if not player.hidden:
@@ -576,10 +769,16 @@ class MazeGame(Gtk.DrawingArea):
             logging.debug("Leave: %s", player.nick)
             self._mark_point_dirty(player.position)
             self.allplayers.remove(player)
-            for bonusplayer in player.bonusPlayers():
+            del self._by_slot[player.slot]
+            for bonusplayer in player.bonusplayers or []:
                 self._mark_point_dirty(bonusplayer.position)
                 self.allplayers.remove(bonusplayer)
+                del self._by_slot[bonusplayer.slot]
+            for gone in [player] + (player.bonusplayers or []):
+                self.engine.remove(gone.slot)
             del self.remoteplayers[buddy.props.key]
+            self._remote_versions.pop(buddy.props.key, None)
+            self._remote_algorithms.pop(buddy.props.key, None)
 
     def msg_received(self, buddy, message):
         logging.debug('msg received %s', message)
@@ -613,11 +812,25 @@ class MazeGame(Gtk.DrawingArea):
             req_maze
                 Request to please send me the maze.  Reply is maze:.
 
-            maze: running_time, seed, width, height, risk, [holes...]
+            versions: version, [version...]
+                The maze versions that a player can build.  Players who
+                never sent this only build Maze.LEGACY mazes.
+
+            algorithms: name, [name...]
+                The generators.ENGINES that a player can build mazes
+                with.  Players who never sent this only have
+                Maze.BACKTRACKER.
+
+            maze: running_time, seed, width, height, risk, [holes...],
+                    [version], [algorithm]
                 A player has a different maze.
                 The one that has been running the longest will force all other
                 players to use that maze.
                 This way new players will join the existing game properly.
+                holes is the number of passed holes followed by their x, y.
+                version is only sent, after a holes count that may be 0,
+                for mazes that are not Maze.LEGACY, and the algorithm
+                name after it for mazes not built by Maze.BACKTRACKER.
 
             move: x, y, dx, dy
                 A player at x, y is now moving in direction dx, dy
@@ -637,9 +850,23 @@ class MazeGame(Gtk.DrawingArea):
             return
         if message == "req_maze":
             self._handle_req_maze(player)
+        elif message.startswith("versions:"):
+            self._remote_versions[player.uid] = \
+                set(int(v) for v in message[9:].split(","))
+        elif message.startswith("algorithms:"):
+            self._remote_algorithms[player.uid] = \
+                set(message[11:].split(","))
+        elif message.startswith(("move:", "step:")) and \
+                self._maze_request is not None:
+            # the new maze would put them back at the start, so move
+            # them once it is ready
+            self._held_moves[player] = message
         elif message.startswith("move:"):
             # a player has moved
             x, y, dx, dy = message[5:].split(",")[:5]
+            if not self.maze.inside(int(x), int(y)):
+                logging.error('%s is off the maze: %s', player.nick, message)
+                return
 
             self._mark_point_dirty(player.position)
             player.position = (int(x), int(y))
@@ -649,6 +876,9 @@ class MazeGame(Gtk.DrawingArea):
         elif message.startswith("step:"):
             # a player has moved using the accelerometer
             x, y, dx, dy = message[5:].split(",")[:5]
+            if not self.maze.inside(int(x), int(y)):
+                logging.error('%s is off the maze: %s', player.nick, message)
+                return
 
             self._mark_point_dirty(player.position)
             player.position = (int(x), int(y))
@@ -658,14 +888,34 @@ class MazeGame(Gtk.DrawingArea):
         elif message.startswith("maze:"):
             # someone has a different maze than us
             self._activity.update_alert('Connected', 'Maze shared!')
-            values = [int(x) for x in message[5:].split(",")]
+            values = message[5:].split(",")
+            algorithm = Maze.BACKTRACKER
+            if not values[-1].isdigit():
+                algorithm = values.pop()
+            values = [int(x) for x in values]
 
             if len(values) == 4:  # peer does not support risk
                 values.append(0)
                 self._activity.disable_risk()
             running_time, seed, width, height, risk = values[:5]
-
-            if self.maze.seed == seed:
+            passed = []
+            version = Maze.LEGACY
+            if len(values) > 5:
+                n = values[5]
+                for i in range(n):
+                    passed.append((values[5 + i * 2 + 1],
+                                   values[5 + i * 2 + 2]))
+                if len(values) > 6 + n * 2:
+                    version = values[6 + n * 2]
+
+            if algorithm not in generators.ENGINES:
+                logging.error('Cannot build a maze with %s', algorithm)
+                return
+            if version not in Maze.VERSIONS:
+                logging.error('Cannot build maze version %d', version)
+                return
+            current = self._maze_key()
+            if current[0] == seed and current[4:] == (version, algorithm):
                 logging.debug('Same seed, don\'t reload Maze')
                 return
             # is that maze older than the one we're already playing?
@@ -675,20 +925,14 @@ class MazeGame(Gtk.DrawingArea):
             if self.game_running_time() < running_time:
                 # make note of the earlier time that the game really
                 # started (before we joined)
-                self.game_start_time = time.time() - running_time
+                self.engine.start_time = \
+                    self.engine.clock() - running_time
                 # use the new seed
-                self._activity.busy()
                 self._activity.set_risk(risk)
-                self.maze = Maze(seed, width, height, risk)
-                # mark passed holes
-                if len(values) > 5:
-                    n = int(values[5])
-                    for i in range(n):
-                        x = int(values[5 + i * 2 + 1])
-                        y = int(values[5 + i * 2 + 2])
-                        self.maze.map[x][y] = self.maze.PASSED
-                self._activity.unbusy()
-                self.reset()
+                if version != Maze.LEGACY:
+                    self.algorithm = algorithm
+                self._load_maze(
+                    (seed, width, height, risk, version, algorithm), passed)
         elif message.startswith("finish:"):
             # someone finished the maze
             logging.debug('finish for nick %s (received data)' % (player.nick))
@@ -705,48 +949,74 @@ class MazeGame(Gtk.DrawingArea):
             # it was something I don't recognize...
             logging.debug("Message from %s: %s", player.nick, message)
 
-    def harder(self):
-        """Make a new maze that is harder than the current one."""
+    def _harder_size(self):
         # both width and height must be odd
-        newHeight = self.maze.height + 2
+        newHeight = self._maze_key()[2] + 2
         if newHeight > 125:
             newHeight = 125
         newWidth = int(newHeight * self.aspectRatio)
         if newWidth % 2 == 0:
             newWidth -= 1
-        self._restart(newWidth, newHeight, self.maze.risk)
+        return newWidth, newHeight
 
-    def easier(self):
-        """Make a new maze that is easier than the current one."""
+    def _easier_size(self):
         # both width and height must be odd
-        newHeight = max(self.maze.height - 2, 9)
+        newHeight = max(self._maze_key()[2] - 2, 9)
         newWidth = int(newHeight * self.aspectRatio)
         if newWidth % 2 == 0:
             newWidth -= 1
-        self._restart(newWidth, newHeight, self.maze.risk)
+        return newWidth, newHeight
+
+    def harder(self):
+        """Make a new maze that is harder than the current one."""
+        newWidth, newHeight = self._harder_size()
+        self._restart(newWidth, newHeight, self._maze_key()[3],
+                      self.TARGET_STEP)
+
+    def easier(self):
+        """Make a new maze that is easier than the current one."""
+        newWidth, newHeight = self._easier_size()
+        self._restart(newWidth, newHeight, self._maze_key()[3],
+                      1 / self.TARGET_STEP)
+
+    def _prefetch(self):
+        """Generate the mazes that restart(), harder() and easier()
+        would switch to, while the player solves this one."""
+        sizes = [(self.maze.width, self.maze.height),
+                 self._harder_size(), self._easier_size()]
+        self._builder.prefetch(
+            [self._new_key(self.maze.seed + 1, width, height, self.maze.risk)
+             for width, height in sizes])
+
+    def set_targeted(self, targeted):
+        """Pick the mazes of restart(), harder() and easier() by their
+        difficulty.quick_score() rather than by seed alone: the next
+        maze is the one closest to the score of this one, times
+        TARGET_STEP for harder() or divided by it for easier()."""
+        self.targeted = targeted
+
+    def set_algorithm(self, algorithm):
+        """Build new mazes with one of generators.ENGINES."""
+        self.algorithm = algorithm
+        self.restart()
 
     def set_risk(self, risk):
-        self._restart(self.maze.width, self.maze.height, risk)
+        width, height = self._maze_key()[1:3]
+        self._restart(width, height, risk)
 
     def restart(self):
-        self._restart(self.maze.width, self.maze.height, self.maze.risk)
+        width, height, risk = self._maze_key()[1:4]
+        self._restart(width, height, risk)
 
-    def _restart(self, newWidth, newHeight, risk):
-        self._activity.busy()
-        self.maze = Maze(self.maze.seed + 1, newWidth, newHeight, risk)
-        self.reset()
-        # tell everyone which maze we are playing, so they can sync up
-        if len(self.remoteplayers) > 0:
-            # but fudge it a little so that we can be sure they'll use our maze
-            self.game_start_time -= 10
-            self._send_maze()
-        self._activity.unbusy()
+    def _restart(self, newWidth, newHeight, risk, step=1.0):
+        self._load_maze(self._new_key(self._maze_key()[0] + 1, newWidth,
+                                      newHeight, risk), announce=True,
+                        scale=step if self.targeted else None)
 
-    def finish(self, player):
+    def __finish_cb(self, slot):
+        player = self._by_slot[slot]
         logging.debug(
             'finish for nick %s (locally determined)' % (player.nick))
-        self.finish_time = time.time()
-        player.elapsed = self.finish_time - self.level_start_time
         self.redraw()
         if len(self.remoteplayers) > 0 and \
                 player == self.localplayers[0]:
@@ -758,23 +1028,12 @@ class MazeGame(Gtk.DrawingArea):
         """ check if the game is over, and if true show the finish window """
 
         # is this the first player to reach the goal?
-        winner = True
-        for players in self.allplayers:
-            if players.elapsed is not None and player.elapsed > \
-                    players.elapsed:
-                winner = False
-        if winner:
-            player.victories += 1
+        if self.engine.award(player.slot):
             logging.debug('victory++ for nick %s now %d' %
                           (player.nick, player.victories))
 
         # are all players finished?
-        all_finished = True
-        for player in self.allplayers:
-            if not player.hidden and player.elapsed is None:
-                all_finished = False
-
-        if all_finished:
+        if self.engine.over():
             parent_xid = self.get_toplevel().get_window()
             self._finish_window = FinishWindow(self, parent_xid)
 
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Maze generators other than Maze.dig().
+
+See http://www.astrolog.org/labyrnth/algrithm.htm for the algorithms.
+
+ENGINES maps a name to each generator that Maze can be built with, as
+in Maze(seed, width, height, risk, Maze.XORSHIFT, 'prim').  A generator
+with knobs is registered once per setting of them that peers can ask
+for by name.  An engine is called as engine(maze, x, y, progress) on a
+maze.map that is all
+SOLID, and carves its passages starting from the room at (x, y).  It
+draws its random numbers from maze.generator, a prng.XorShift32, so
+the maze only depends on the seed.  progress, if not None, is called
+with the fraction of the rooms carved every Maze.PROGRESS_STEP rooms.
+"""
+
+import functools
+import multiprocessing
+
+from maze import Maze
+from packedmaze import PackedMaze, wall_digits
+import prng
+
+ENGINES = {}
+
+
+def register(name, **knobs):
+    """Register the decorated generator as name, called with knobs."""
+    def decorator(function):
+        if knobs:
+            ENGINES[name] = functools.partial(function, **knobs)
+        else:
+            ENGINES[name] = function
+        return function
+    return decorator
+
+
+def _steps(grid):
+    """The index offsets to the four neighbours, up, right, down, left."""
+    return [grid.offsets[d] for d in Maze.DIRECTIONS]
+
+
+def _rooms(maze):
+    return max(1, ((maze.width - 1) // 2) * ((maze.height - 1) // 2))
+
+
+@register(Maze.BACKTRACKER)
+def backtracker(maze, x, y, progress=None):
+    """The recursive backtracker of Maze.dig(): long twisty passages
+    and few dead ends."""
+    maze.dig(x, y, progress)
+
+
+@register('growing-tree-flat', bias=0.8)
+@register('growing-tree-winding', keep=0.85)
+@register('growing-tree')
+def growing_tree(maze, x, y, progress=None, keep=0.5, bias=0.5):
+    """The growing tree algorithm, with the two knobs of docs/NOTES.txt.
+
+    Each step carves on from a room of the list of rooms that may still
+    have a neighbour to dig to: the newest room with probability keep,
+    which carries on the current path, or else any room of the list.
+    With keep=1 this is the backtracker, with keep=0 it looks like
+    Prim's algorithm.  When both ways are open, the passage goes
+    horizontally with probability bias, so a high bias makes long
+    horizontal corridors.
+    """
+    rng = maze.generator
+    cells = maze.map.cells
+    solid, empty = Maze.SOLID, Maze.EMPTY
+    steps = _steps(maze.map)
+    keep = int(keep * 2 ** 32)
+    bias = int(bias * 2 ** 32)
+
+    i = maze.map.index(x, y)
+    cells[i] = empty
+    active = [i]
+    rooms, dug = _rooms(maze), 1
+    report = Maze.PROGRESS_STEP if progress else 0
+    while active:
+        if rng.next() < keep:
+            k = len(active) - 1
+        else:
+            k = rng.randbelow(len(active))
+        i = active[k]
+        across = [s for s in steps[1::2] if cells[i + 2 * s] == solid]
+        upright = [s for s in steps[0::2] if cells[i + 2 * s] == solid]
+        if not across and not upright:
+            del active[k]
+            continue
+        if across and (not upright or rng.next() < bias):
+            options = across
+        else:
+            options = upright
+        step = options[rng.randbelow(len(options))]
+        cells[i + step] = empty
+        cells[i + 2 * step] = empty
+        active.append(i + 2 * step)
+        dug += 1
+        if dug == report:
+            progress(dug / rooms)
+            report += Maze.PROGRESS_STEP
+
+
+@register('prim')
+def prim(maze, x, y, progress=None):
+    """Randomized Prim's algorithm: grow the maze from a random room of
+    its frontier.  Lots of short dead ends, and an easy solution."""
+    rng = maze.generator
+    cells = maze.map.cells
+    solid, empty, frontier = Maze.SOLID, Maze.EMPTY, Maze.SEEN
+    steps = _steps(maze.map)
+
+    rooms, dug = _rooms(maze), 0
+    report = Maze.PROGRESS_STEP if progress else 0
+    edge = [maze.map.index(x, y)]
+    while edge:
+        # take a random frontier room; the order of edge does not matter
+        k = rng.randbelow(len(edge))
+        i = edge[k]
+        edge[k] = edge[-1]
+        edge.pop()
+        joins = [s for s in steps if cells[i + 2 * s] == empty]
+        if joins:
+            cells[i + joins[rng.randbelow(len(joins))]] = empty
+        cells[i] = empty
+        for s in steps:
+            if cells[i + 2 * s] == solid:
+                cells[i + 2 * s] = frontier
+                edge.append(i + 2 * s)
+        dug += 1
+        if dug == report:
+            progress(dug / rooms)
+            report += Maze.PROGRESS_STEP
+
+
+@register('kruskal')
+def kruskal(maze, x, y, progress=None):
+    """Randomized Kruskal's algorithm: knock down the walls between
+    rooms in a random order, when they join two separate parts.  Does
+    not start anywhere in particular, so (x, y) is not used."""
+    rng = maze.generator
+    grid = maze.map
+    cells = grid.cells
+    right, down = grid.offsets[(1, 0)], grid.offsets[(0, 1)]
+
+    walls = []
+    for ry in range(1, maze.height, 2):
+        for rx in range(1, maze.width, 2):
+            i = grid.index(rx, ry)
+            cells[i] = Maze.EMPTY
+            if rx + 2 < maze.width:
+                walls.append(i + right)
+            if ry + 2 < maze.height:
+                walls.append(i + down)
+    for n in range(len(walls) - 1, 0, -1):
+        k = rng.randbelow(n + 1)
+        walls[n], walls[k] = walls[k], walls[n]
+
+    parent = {}
+
+    def find(i):
+        root = i
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while i != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    rooms, joined = _rooms(maze), 1
+    report = Maze.PROGRESS_STEP if progress else 0
+    for wall in walls:
+        # the wall lies between the rooms to its left and right when it
+        # is on a row of rooms, above and below when it is not
+        step = 1 if cells[wall - 1] == Maze.EMPTY else grid.stride
+        a, b = find(wall - step), find(wall + step)
+        if a == b:
+            continue
+        parent[b] = a
+        cells[wall] = Maze.EMPTY
+        joined += 1
+        if joined == report:
+            progress(joined / rooms)
+            report += Maze.PROGRESS_STEP
+        if joined == rooms:
+            break
+
+
+@register('braid')
+def braid(maze, x, y, progress=None):
+    """A braid maze: the backtracker's maze with every dead end opened
+    into a neighbouring room, a dead end itself when there is one.
+    There are loops and no dead ends, so there is more than one way to
+    the goal and to get lost."""
+    maze.dig(x, y, progress)
+    rng = maze.generator
+    cells = maze.map.cells
+    empty = Maze.EMPTY
+    steps = _steps(maze.map)
+
+    def exits(i):
+        return sum(cells[i + s] == empty for s in steps)
+
+    for ry in range(1, maze.height, 2):
+        for rx in range(1, maze.width, 2):
+            i = maze.map.index(rx, ry)
+            if exits(i) != 1:
+                continue
+            walls = [s for s in steps
+                     if cells[i + s] != empty and cells[i + 2 * s] == empty]
+            if not walls:
+                continue
+            ends = [s for s in walls if exits(i + 2 * s) == 1]
+            walls = ends or walls
+            cells[i + walls[rng.randbelow(len(walls))]] = empty
+
+
+@register('eller')
+def eller(maze, x, y, progress=None):
+    """Eller's algorithm, from eller_rows(); (x, y) is not used."""
+    grid = maze.map
+    rows = eller_rows(maze.seed, maze.width, maze.height)
+    for n, row in enumerate(rows):
+        start = grid.index(0, n)
+        grid.cells[start:start + maze.width] = row
+        if progress and n % 64 == 63:
+            progress(n / maze.height)
+
+
+def eller_rows(seed, width, height):
+    """Yield the rows of tiles of a perfect maze, top to bottom.
+
+    This is Eller's algorithm: only the sets of the current row of rooms
+    are kept, so memory is O(width) however tall the maze is, and each
+    row can be drawn, written out or stored as soon as it is yielded.
+    The maze only depends on the seed and size.  Sizes must be odd.
+
+    Rooms are joined with a coin flip from prng.XorShift32 (the top bit
+    of next()).  Then each set of rooms goes down from each of its
+    rooms with a coin flip, or from one room picked with randbelow() if
+    no flip came up.
+    """
+    if width % 2 == 0 or height % 2 == 0:
+        raise ValueError('mazes must have odd sizes')
+    rng = prng.XorShift32(seed)
+    columns, rows = (width - 1) // 2, (height - 1) // 2
+    solid, empty = bytes([Maze.SOLID]), bytes([Maze.EMPTY])
+
+    # sets[c] is the set of room c in this row, members the rooms of
+    # each set in this row
+    sets = list(range(columns))
+    members = {c: [c] for c in range(columns)}
+    fresh = columns
+
+    yield solid * width
+    for r in range(rows):
+        last = r == rows - 1
+        row = bytearray(solid * width)
+        row[1::2] = empty * columns
+
+        # join neighbouring rooms of different sets, at random
+        for c in range(columns - 1):
+            a, b = sets[c], sets[c + 1]
+            if a != b and (last or rng.next() >> 31):
+                row[2 * c + 2] = Maze.EMPTY
+                # relabel the smaller set
+                if len(members[a]) < len(members[b]):
+                    a, b = b, a
+                moved = members.pop(b)
+                for c2 in moved:
+                    sets[c2] = a
+                members[a].extend(moved)
+        yield bytes(row)
+
+        row = bytearray(solid * width)
+        if not last:
+            # every set goes down at least once; the rooms that don't
+            # start a new set in the next row
+            below = {}
+            for s, rooms in members.items():
+                down = [c for c in rooms if rng.next() >> 31]
+                if not down:
+                    down = [rooms[rng.randbelow(len(rooms))]]
+                below[s] = down
+            sets = [None] * columns
+            for s, down in below.items():
+                for c in down:
+                    sets[c] = s
+                    row[2 * c + 1] = Maze.EMPTY
+            members = {s: list(down) for s, down in below.items()}
+            for c in range(columns):
+                if sets[c] is None:
+                    sets[c] = fresh
+                    members[fresh] = [c]
+                    fresh += 1
+        yield bytes(row)
+
+
+def eller_maze(seed, width, height):
+    """Build a whole Maze with eller_rows().  To keep a very tall maze
+    small, pack it instead with PackedMaze.from_rows()."""
+    return Maze(seed, width, height, 0, Maze.XORSHIFT, 'eller')
+
+
+def tile_seed(seed, index):
+    """The seed of tile number index of a tiled maze."""
+    return prng.seed_state(seed) << 32 | index
+
+
+def _carve_tile(args):
+    """Carve one tile and return the wall digits of its rooms."""
+    seed, columns, rows = args
+    maze = Maze(seed, 2 * columns + 1, 2 * rows + 1, 0, Maze.XORSHIFT)
+    return wall_digits(maze.map.rows())
+
+
+def tiled_maze(seed, width, height, tile_size, processes=None):
+    """Build a perfect maze as tiles carved in parallel.
+
+    The rooms are cut into tiles of tile_size x tile_size rooms (smaller
+    at the right and bottom edges), numbered left to right, top to
+    bottom.  Each tile is carved with Maze.dig() from tile_seed(seed,
+    number), in a pool of `processes` processes, or in this one when
+    processes is 1.  Each tile is a perfect maze on its own, so the
+    tiles are then joined along a random spanning tree of the tile
+    grid (Kruskal's algorithm over the shuffled borders), through one
+    random passage per border.  That keeps the whole maze perfect.
+
+    The result, a PackedMaze, only depends on (seed, width, height,
+    tile_size), never on the number of processes.  The pool uses the
+    'spawn' start method, which is safe from a threaded GTK process.
+    """
+    if width % 2 == 0 or height % 2 == 0:
+        raise ValueError('mazes must have odd sizes')
+    columns, rows = (width - 1) // 2, (height - 1) // 2
+    across = (columns + tile_size - 1) // tile_size
+    down = (rows + tile_size - 1) // tile_size
+
+    def span(n, total):
+        return min(tile_size, total - n * tile_size)
+
+    jobs = [(tile_seed(seed, j * across + i), span(i, columns),
+             span(j, rows))
+            for j in range(down) for i in range(across)]
+    if processes == 1:
+        tiles = [_carve_tile(job) for job in jobs]
+    else:
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes) as pool:
+            tiles = pool.map(_carve_tile, jobs)
+
+    # lay the rows of the tiles side by side
+    east, south = [], []
+    for j in range(down):
+        band = tiles[j * across:(j + 1) * across]
+        for r in range(span(j, rows)):
+            east.append(bytearray(b''.join(tile[0][r] for tile in band)))
+            south.append(bytearray(b''.join(tile[1][r] for tile in band)))
+
+    # join the tiles along a random spanning tree
+    rng = prng.XorShift32(seed)
+    borders = [(t, t + 1) for t in range(across * down)
+               if t % across != across - 1]
+    borders += [(t, t + across) for t in range(across * (down - 1))]
+    for n in range(len(borders) - 1, 0, -1):
+        k = rng.randbelow(n + 1)
+        borders[n], borders[k] = borders[k], borders[n]
+    parent = list(range(across * down))
+
+    def find(t):
+        while parent[t] != t:
+            parent[t] = parent[parent[t]]
+            t = parent[t]
+        return t
+
+    for a, b in borders:
+        ra, rb = find(a), find(b)
+        if ra == rb:
+            continue
+        parent[rb] = ra
+        i, j = a % across, a // across
+        if b == a + 1:
+            # open the east wall of a room in the last column of a
+            r = j * tile_size + rng.randbelow(span(j, rows))
+            east[r][(i + 1) * tile_size - 1] = ord('0')
+        else:
+            # open the south wall of a room in the last row of a
+            c = i * tile_size + rng.randbelow(span(i, columns))
+            south[(j + 1) * tile_size - 1][c] = ord('0')
+
+    return PackedMaze.from_digits(width, height, east, south, (), seed, 0,
+                                  Maze.XORSHIFT)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Golden hashes of generated mazes.
+
+Peers only send each other the seed, size, risk, version and algorithm
+of a maze, so every Maze must keep building the very same tiles from
+them.  goldens.txt holds a hash of the tiles of a few thousand mazes;
+check them after changing any generator, from the activity directory:
+
+    python3 goldens.py
+
+Only write them again when a new version or algorithm is added, never
+to make a changed generator pass:
+
+    python3 goldens.py --write
+"""
+
+import hashlib
+import os
+import sys
+
+import generators
+from maze import Maze
+
+GOLDENS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'goldens.txt')
+
+# mazes per version
+COUNT = 1500
+
+
+def cases():
+    """(version, algorithm, seed, width, height, risk) of every golden
+    maze: all heights the game plays, from 9 to 125 rows, in landscape
+    and portrait, with and without holes, and every algorithm for the
+    versions that have them."""
+    algorithms = sorted(generators.ENGINES)
+    heights = range(9, 127, 2)
+    for version in Maze.VERSIONS:
+        for n in range(COUNT):
+            height = heights[n % len(heights)]
+            width = (height * 4 // 3) | 1
+            if n // len(heights) % 2:
+                width, height = height, width
+            seed = n * 2654435761 % (1 << 32)
+            risk = n % 2
+            algorithm = Maze.BACKTRACKER
+            if version != Maze.LEGACY:
+                algorithm = algorithms[n % len(algorithms)]
+            yield version, algorithm, seed, width, height, risk
+
+
+def digest(maze):
+    """A hash of the tiles of a maze, holes included."""
+    return hashlib.sha1(b''.join(maze.map.rows())).hexdigest()[:16]
+
+
+def write():
+    with open(GOLDENS, 'w') as goldens:
+        goldens.write('# version algorithm seed width height risk hash, '
+                      'see goldens.py\n')
+        for case in cases():
+            goldens.write('%d %s %d %d %d %d %s\n' %
+                          (case + (digest(Maze(*case[2:], *case[:2])),)))
+
+
+def check():
+    """Build every maze of goldens.txt.  Return how many differ."""
+    failures = checked = 0
+    with open(GOLDENS) as goldens:
+        for line in goldens:
+            if line.startswith('#'):
+                continue
+            version, algorithm, seed, width, height, risk, expected = \
+                line.split()
+            version, seed, width, height, risk = \
+                [int(value) for value in (version, seed, width, height,
+                                          risk)]
+            maze = Maze(seed, width, height, risk, version, algorithm)
+            checked += 1
+            if digest(maze) != expected:
+                failures += 1
+                print('version %d %s seed %d %dx%d risk %d: %s, not %s' %
+                      (version, algorithm, seed, width, height, risk,
+                       digest(maze), expected))
+    print('%d of %d mazes differ' % (failures, checked))
+    return failures
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--write']:
+        write()
+    else:
+        sys.exit(1 if check() else 0)
@@ -22,9 +22,14 @@
 #     You should have received a copy of the GNU General Public License
 #     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
+import itertools
 import random
+import re
 import logging
 
+import prng
+
 
 class Rectangle:
 
@@ -38,6 +43,59 @@ class Rectangle:
         return (self.x, self.y, self.width, self.height)
 
 
+class Grid:
+    """The tiles of a maze, stored row-major in one flat bytearray.
+
+    The maze is surrounded by a frame PAD tiles wide that holds a border
+    value, so looking up to PAD tiles past the edge of the maze reads the
+    border instead of going out of range and no bounds check is needed.
+    The tile (x, y) is found at index origin + y * stride + x, and the
+    index offsets of the four neighbours are precomputed in `offsets`.
+    """
+
+    PAD = 2
+
+    def __init__(self, width, height, fill=0, border=0):
+        self.width = width
+        self.height = height
+        self.stride = width + 2 * self.PAD
+        self.origin = self.PAD * self.stride + self.PAD
+        self.cells = bytearray([border]) * \
+            (self.stride * (height + 2 * self.PAD))
+        row = bytearray([fill]) * width
+        for y in range(height):
+            start = self.origin + y * self.stride
+            self.cells[start:start + width] = row
+        self.offsets = {(0, -1): -self.stride, (1, 0): 1,
+                        (0, 1): self.stride, (-1, 0): -1}
+
+    def index(self, x, y):
+        return self.origin + y * self.stride + x
+
+    def position(self, index):
+        """Return the (x, y) coordinates of a cell index."""
+        y, x = divmod(index - self.origin, self.stride)
+        return (x, y)
+
+    def get(self, x, y):
+        return self.cells[self.origin + y * self.stride + x]
+
+    def set(self, x, y, value):
+        self.cells[self.origin + y * self.stride + x] = value
+
+    def rows(self):
+        """Iterate over the rows of the grid, top to bottom."""
+        for y in range(self.height):
+            start = self.origin + y * self.stride
+            yield self.cells[start:start + self.width]
+
+    def copy(self):
+        grid = Grid.__new__(Grid)
+        grid.__dict__.update(self.__dict__)
+        grid.cells = bytearray(self.cells)
+        return grid
+
+
 class Maze:
     SOLID = 0
     EMPTY = 1
@@ -45,74 +103,173 @@ class Maze:
     GOAL = 3
     HOLE = 4
     PASSED = 5
+    # the frame around the maze: never walkable and never dug
+    BORDER = 255
+
+    # whether a player can stand on each tile value: all but SOLID (0)
+    # and BORDER (255)
+    PASSABLE = (False,) + (True,) * 254 + (False,)
+
+    # bytes.translate() table from tile values to 1 (open) or 0 (solid)
+    _OPEN = bytes(PASSABLE)
+
+    DIRECTIONS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+    # maze generator versions, shared with peers in the maze: message:
+    # LEGACY uses random.Random, as every Maze before versions existed,
+    # XORSHIFT uses the portable prng.XorShift32
+    LEGACY = 1
+    XORSHIFT = 2
+    VERSIONS = (LEGACY, XORSHIFT)
+
+    # the generator of every Maze before generators.ENGINES existed,
+    # and the only one that can build LEGACY mazes
+    BACKTRACKER = 'backtracker'
+
+    # how many cells dig() carves between two calls to progress
+    PROGRESS_STEP = 4096
+
+    # a run of SOLID tiles, see walls()
+    _SOLID_RUN = re.compile(b'\x00+')
+
+    def __init__(self, seed, width, height, risk, version=LEGACY,
+                 algorithm=BACKTRACKER, progress=None):
+        # generators registers its engines with this module imported
+        import generators
 
-    def __init__(self, seed, width, height, risk):
         # use the seed given to us to make a pseudo-random number generator
         # we will use that to generate the maze, so that other players can
         # generate the exact same maze given the same seed.
         logging.debug("Generating maze: seed %d, width %d, \
-            height %d, risk %d", seed, width, height, risk)
+            height %d, risk %d, version %d, algorithm %s", seed, width,
+                      height, risk, version, algorithm)
+        if version not in self.VERSIONS:
+            raise ValueError('unknown maze version %r' % version)
+        if algorithm not in generators.ENGINES:
+            raise ValueError('unknown maze algorithm %r' % algorithm)
+        if version == self.LEGACY and algorithm != self.BACKTRACKER:
+            raise ValueError('legacy mazes are only built by the %s'
+                             % self.BACKTRACKER)
         self.seed = seed
-        self.generator = random.Random(seed)
+        self.version = version
+        self.algorithm = algorithm
+        if version == self.LEGACY:
+            self.generator = random.Random(seed)
+        else:
+            self.generator = prng.XorShift32(seed)
         self.width, self.height, self.risk = width, height, risk
-        self.map = []
+        self.map = Grid(width, height, self.SOLID, self.BORDER)
         self.holes = []
+        self.holes_wanted = 0
         self.bounds = Rectangle(0, 0, width, height)
-        for x in range(0, width):
-            self.map.append([self.SOLID] * self.height)
+        self._walls = None
+        self._corridors = None
+        self._field = None
 
         startx = self.generator.randrange(1, width, 2)
         starty = self.generator.randrange(1, height, 2)
-        self.dig(startx, starty)
+        generators.ENGINES[algorithm](self, startx, starty, progress)
         if self.risk:
             self._make_risk()
 
-        for row in self.map:
-            logging.debug(row)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for row in self.map.rows():
+                logging.debug(list(row))
 
     def _make_risk(self):
         if self.width <= 15:
             max_holes = 1
         else:
             max_holes = int(self.width / 7) - 1
+        self.holes_wanted = max_holes
 
-        holes = 0
-        while holes != max_holes:
-            x = self.generator.randrange(1, self.width, 1)
-            y = self.generator.randrange(1, self.height, 1)
+        candidates = self.holeCandidates()
 
-            if self.validHole(x, y):
-                self.map[x][y] = self.HOLE
-                self.holes.append((x, y))
-                holes += 1
+        if self.version == self.LEGACY:
+            # keep drawing random tiles, exactly as old peers do.  A
+            # tile can be drawn twice, so this ends as soon as there is
+            # one candidate, and never with none
+            if not candidates:
+                return
+            holes = 0
+            while holes != max_holes:
+                x = self.generator.randrange(1, self.width, 1)
+                y = self.generator.randrange(1, self.height, 1)
 
-    def _check_point_in_rectangle(self, rectangle, x, y):
-        if x < rectangle.x or y < rectangle.y:
-            return False
-        if x >= rectangle.x + rectangle.width or \
-                y >= rectangle.y + rectangle.height:
-            return False
-        return True
+                if self.validHole(x, y):
+                    self.map.set(x, y, self.HOLE)
+                    self.holes.append((x, y))
+                    holes += 1
+            return
+
+        if len(candidates) < max_holes:
+            logging.warning('Only %d of %d holes fit in the maze',
+                            len(candidates), max_holes)
+
+        # draw the holes from the candidates without replacement, with
+        # the first steps of a Fisher-Yates shuffle
+        for n in range(min(max_holes, len(candidates))):
+            j = n + self.generator.randbelow(len(candidates) - n)
+            candidates[n], candidates[j] = candidates[j], candidates[n]
+            self.map.cells[candidates[n]] = self.HOLE
+            self.holes.append(self.map.position(candidates[n]))
+
+    def holeCandidates(self):
+        """Return the cell indices of every tile where validHole() is
+        true, in index order.
+
+        Each tile is turned into one byte, 1 for open and 0 for solid,
+        and the bytes into one big integer, so shifting it by a byte or
+        by a row lines every tile up with a neighbour and the whole test
+        runs as a handful of integer operations.
+        """
+        grid = self.map
+        size = len(grid.cells)
+        row = 8 * grid.stride
+        tiles = int.from_bytes(grid.cells.translate(self._OPEN), 'little')
+        left, right = tiles << 8, tiles >> 8
+        up, down = tiles << row, tiles >> row
+        across = left & right & ~(up | down)
+        along = up & down & ~(left | right)
+        corridor = tiles & (across | along)
+
+        # holes stay two tiles away from the outside walls
+        inside = bytearray(size)
+        for y in range(2, self.height - 2):
+            start = grid.index(2, y)
+            inside[start:start + self.width - 4] = \
+                b'\x01' * (self.width - 4)
+        corridor &= int.from_bytes(inside, 'little')
+
+        return list(itertools.compress(range(size),
+                                       corridor.to_bytes(size, 'little')))
 
     def validHole(self, x, y):
+        cells, stride = self.map.cells, self.map.stride
+        i = self.map.index(x, y)
         if x > 1 and y > 1 and x < self.width - 2 and y < self.height - 2 \
-                and self.map[x][y] != self.SOLID:
-            left = (self.map[x - 1][y] != self.SOLID)
-            right = (self.map[x + 1][y] != self.SOLID)
-            up = (self.map[x][y + 1] != self.SOLID)
-            down = (self.map[x][y - 1] != self.SOLID)
+                and cells[i] != self.SOLID:
+            left = (cells[i - 1] != self.SOLID)
+            right = (cells[i + 1] != self.SOLID)
+            up = (cells[i + stride] != self.SOLID)
+            down = (cells[i - stride] != self.SOLID)
 
             return (left and right and not (up or down)) or \
                 (up and down and not (left or right))
         return False
 
+    def inside(self, x, y):
+        """Whether (x, y) is a tile of the maze."""
+        return 0 <= x < self.width and 0 <= y < self.height
+
     def validMove(self, x, y):
-        return self._check_point_in_rectangle(self.bounds, x, y) and \
-            self.map[x][y] != self.SOLID
+        grid = self.map
+        return 0 <= x < self.width and 0 <= y < self.height and \
+            self.PASSABLE[grid.cells[grid.origin + y * grid.stride + x]]
 
     def validDig(self, x, y):
-        return self._check_point_in_rectangle(self.bounds, x, y) and \
-            self.map[x][y] == self.SOLID
+        grid = self.map
+        return grid.cells[grid.origin + y * grid.stride + x] == self.SOLID
 
     def validDigDirections(self, x, y):
         directions = []
@@ -130,32 +287,183 @@ class Maze:
         """This works great, except for python's lame limit on
            recursion depth.
         """
-        self.map[x][y] = self.EMPTY
+        self.map.set(x, y, self.EMPTY)
         directions = self.validDigDirections(x, y)
         while len(directions) > 0:
             direction = self.generator.choice(directions)
-            self.map[x + direction[0]][y + direction[1]] = self.EMPTY
+            self.map.set(x + direction[0], y + direction[1], self.EMPTY)
             self.dig(x + direction[0] * 2, y + direction[1] * 2)
             directions = self.validDigDirections(x, y)
 
-    def dig(self, x, y):
-        stack = [(x, y)]
-        while len(stack) > 0:
-            x, y = stack[-1]
-            self.map[x][y] = self.EMPTY
-            directions = self.validDigDirections(x, y)
-            if len(directions) > 0:
-                direction = self.generator.choice(directions)
-                self.map[x + direction[0]][y + direction[1]] = self.EMPTY
-                stack.append((x + direction[0] * 2, y + direction[1] * 2))
+    def dig(self, x, y, progress=None):
+        """Carve the passages with an iterative recursive backtracker.
+
+        progress, if given, is called now and then with the fraction of
+        the maze carved so far.  It may raise to abandon the maze.
+
+        The directions that can be dug are kept as a bitmask (1 up,
+        2 right, 4 down, 8 left) and looked up in a table of tuples, so
+        no list is built on each step.
+
+        For LEGACY mazes this makes exactly the same generator.choice()
+        calls, in the same order, as digging with validDigDirections()
+        would, so old peers build the same maze from the same seed.
+        XORSHIFT mazes inline prng.XorShift32.randbelow() and only draw
+        a number when there is more than one direction to choose from.
+        """
+        cells = self.map.cells
+        solid, empty = self.SOLID, self.EMPTY
+        steps = [self.map.offsets[d] for d in self.DIRECTIONS]
+        up, right, down, left = [2 * step for step in steps]
+        choices = [tuple(step for bit, step in enumerate(steps)
+                         if mask & (1 << bit))
+                   for mask in range(16)]
+
+        i = self.map.index(x, y)
+        cells[i] = empty
+        stack = [i]
+        push, pop = stack.append, stack.pop
+
+        rooms = max(1, ((self.width - 1) // 2) * ((self.height - 1) // 2))
+        dug, report = 1, self.PROGRESS_STEP if progress else 0
+
+        if self.version == self.LEGACY:
+            choice = self.generator.choice
+            while True:
+                mask = (cells[i + up] == solid) | \
+                    (cells[i + right] == solid) << 1 | \
+                    (cells[i + down] == solid) << 2 | \
+                    (cells[i + left] == solid) << 3
+                if mask:
+                    step = choice(choices[mask])
+                    cells[i + step] = empty
+                    i += 2 * step
+                    cells[i] = empty
+                    push(i)
+                    dug += 1
+                    if dug == report:
+                        progress(dug / rooms)
+                        report += self.PROGRESS_STEP
+                else:
+                    pop()
+                    if not stack:
+                        return
+                    i = stack[-1]
+
+        state = self.generator.state
+        while True:
+            mask = (cells[i + up] == solid) | \
+                (cells[i + right] == solid) << 1 | \
+                (cells[i + down] == solid) << 2 | \
+                (cells[i + left] == solid) << 3
+            if mask:
+                options = choices[mask]
+                if len(options) == 1:
+                    step = options[0]
+                else:
+                    state ^= (state << 13) & prng.MASK
+                    state ^= state >> 17
+                    state ^= (state << 5) & prng.MASK
+                    step = options[(state * len(options)) >> 32]
+                cells[i + step] = empty
+                i += 2 * step
+                cells[i] = empty
+                push(i)
+                dug += 1
+                if dug == report:
+                    progress(dug / rooms)
+                    report += self.PROGRESS_STEP
             else:
-                stack.pop()
+                pop()
+                if not stack:
+                    break
+                i = stack[-1]
+        self.generator.state = state
+
+    @classmethod
+    def from_grid(cls, grid, seed=0, risk=0, version=LEGACY, holes=(),
+                  algorithm=BACKTRACKER):
+        """Make a Maze around tiles that were not generated here, such
+        as an unpacked PackedMaze."""
+        maze = cls.__new__(cls)
+        maze.seed, maze.version, maze.risk = seed, version, risk
+        maze.algorithm = algorithm
+        maze.generator = None
+        maze.width, maze.height = grid.width, grid.height
+        maze.map = grid
+        maze.holes = list(holes)
+        maze.holes_wanted = len(maze.holes)
+        maze.bounds = Rectangle(0, 0, grid.width, grid.height)
+        maze._walls = None
+        maze._corridors = None
+        maze._field = None
+        return maze
+
+    def copy(self):
+        """Return a copy of the maze that can be played on without
+        changing this one."""
+        maze = copy.copy(self)
+        maze.map = self.map.copy()
+        maze.holes = list(self.holes)
+        if self._corridors is not None:
+            maze._corridors = self._corridors.copy(maze)
+        if self._field is not None:
+            maze._field = self._field.copy(maze)
+        return maze
+
+    def corridors(self):
+        """The corridors.CorridorGraph of the maze.  Walls stay put,
+        so it is only worked out once, and copies share it."""
+        if self._corridors is None:
+            from corridors import CorridorGraph
+            self._corridors = CorridorGraph(self)
+        return self._corridors
+
+    def distance_field(self):
+        """The solver.DistanceField of the maze, worked out once.
+        Whoever passes a hole must open() it there."""
+        if self._field is None:
+            from solver import DistanceField
+            self._field = DistanceField(self)
+        return self._field
+
+    def walls(self):
+        """The SOLID tiles as a few (x, y, width, height) rectangles:
+        each run of walls two or more long across a row or down a
+        column, and the walls that stand alone.  Rectangles overlap
+        where runs cross.  Walls stay put once the maze is built, so
+        they are only worked out once."""
+        if self._walls is not None:
+            return self._walls
+        grid = self.map
+        walls, alone = [], []
+        for y, row in enumerate(grid.rows()):
+            for run in self._SOLID_RUN.finditer(row):
+                x, length = run.start(), run.end() - run.start()
+                if length > 1:
+                    walls.append((x, y, length, 1))
+                else:
+                    alone.append((x, y))
+        for x in range(self.width):
+            column = grid.cells[grid.index(x, 0):grid.index(x, self.height):
+                                grid.stride]
+            for run in self._SOLID_RUN.finditer(column):
+                if run.end() - run.start() > 1:
+                    walls.append((x, run.start(), 1, run.end() - run.start()))
+        up, down = grid.offsets[(0, -1)], grid.offsets[(0, 1)]
+        for x, y in alone:
+            i = grid.index(x, y)
+            if grid.cells[i + up] != self.SOLID and \
+                    grid.cells[i + down] != self.SOLID:
+                walls.append((x, y, 1, 1))
+        self._walls = walls
+        return walls
 
     def get_passed(self):
         ''' Return a list of hole coordinate pairs that have been passed. '''
         passed = []
         for hole in self.holes:
             x, y = hole
-            if self.map[x][y] == self.PASSED:
+            if self.map.get(x, y) == self.PASSED:
                 passed.append(hole)
         return passed
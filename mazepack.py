@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Packs of mazes generated ahead of time, in one file.
+
+Write the levels of a curriculum, in the order they are played:
+
+    python3 mazepack.py levels.mzk --sizes 15x9,45x25,91x51 --seeds 0:20
+
+and list what is in a pack:
+
+    python3 mazepack.py levels.mzk
+
+A pack is a HEADER, then an index of one ENTRY per maze, then the
+mazes, each as written by PackedMaze.to_bytes().  All numbers are
+little-endian.  An entry holds the key the maze was built from, as in
+builder.MazeCache, where to find it in the file, and how hard it is.
+"""
+
+import argparse
+import collections
+import mmap
+import struct
+import sys
+
+from difficulty import analyse
+from maze import Maze
+from packedmaze import PackedMaze
+
+# magic, number of mazes
+HEADER = struct.Struct('<4sI')
+MAGIC = b'MZK1'
+# offset, size, seed, width, height, risk, version, algorithm,
+# solution, dead ends, hole risk
+ENTRY = struct.Struct('<QIqHHBB16siIH')
+
+Entry = collections.namedtuple(
+    'Entry', 'offset size seed width height risk version algorithm '
+    'solution dead_ends hole_risk')
+
+
+def write(path, keys):
+    """Generate the maze of each (seed, width, height, risk, version,
+    algorithm) key and write them all to a pack.  Return the number of
+    mazes written."""
+    keys = list(keys)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(keys)))
+        # the index is filled in once the mazes are written
+        f.write(bytes(ENTRY.size * len(keys)))
+        entries = []
+        for key in keys:
+            maze = Maze(*key)
+            data = PackedMaze.from_maze(maze).to_bytes()
+            difficulty = analyse(maze)
+            seed, width, height, risk, version, algorithm = key
+            entries.append(ENTRY.pack(
+                f.tell(), len(data), seed, width, height, risk, version,
+                algorithm.encode(), difficulty.solution,
+                difficulty.dead_ends, difficulty.hole_risk))
+            f.write(data)
+        f.seek(HEADER.size)
+        f.write(b''.join(entries))
+    return len(keys)
+
+
+class MazePack:
+    """A pack file, mapped into memory rather than read.
+
+    The index is read with struct.unpack_from() straight off the map,
+    and the bitsets of the PackedMaze of any entry are views of it, so
+    a maze costs only the pages of the file it is stored on.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError('not a maze pack: %s' % path)
+        self._keys = None
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, n):
+        """The Entry of maze number n."""
+        if not 0 <= n < self.count:
+            raise IndexError('maze pack index out of range')
+        fields = ENTRY.unpack_from(self._map, HEADER.size + n * ENTRY.size)
+        return Entry(*fields[:7], fields[7].rstrip(b'\0').decode(),
+                     *fields[8:])
+
+    def key(self, n):
+        entry = self.entry(n)
+        return (entry.seed, entry.width, entry.height, entry.risk,
+                entry.version, entry.algorithm)
+
+    def packed(self, n):
+        """The PackedMaze of maze number n, viewing the pack."""
+        return PackedMaze.from_bytes(self._map, self.entry(n).offset)
+
+    def maze(self, n):
+        """Maze number n, ready to play."""
+        return self.packed(n).to_maze(self.entry(n).algorithm)
+
+    def find(self, key):
+        """The number of the maze built from key, or None."""
+        if self._keys is None:
+            self._keys = {self.key(n): n for n in range(self.count)}
+        return self._keys.get(key)
+
+    def get(self, key):
+        """The maze built from key, or None if it is not in the pack."""
+        n = self.find(key)
+        return None if n is None else self.maze(n)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path', help='pack file')
+    parser.add_argument('--sizes',
+                        help='write mazes of these WIDTHxHEIGHT, '
+                        'comma separated')
+    parser.add_argument('--seeds', default='0:1',
+                        help='first:last seed of each size, last excluded')
+    parser.add_argument('--risk', type=int, default=0)
+    parser.add_argument('--version', type=int, default=Maze.XORSHIFT)
+    parser.add_argument('--algorithm', default=Maze.BACKTRACKER)
+    args = parser.parse_args(argv)
+
+    if args.sizes:
+        first, last = [int(n) for n in args.seeds.split(':')]
+        sizes = [[int(n) for n in size.split('x')]
+                 for size in args.sizes.split(',')]
+        write(args.path, [(seed, width, height, args.risk, args.version,
+                           args.algorithm)
+                          for width, height in sizes
+                          for seed in range(first, last)])
+    with MazePack(args.path) as pack:
+        for n in range(len(pack)):
+            entry = pack.entry(n)
+            print('%4d %dx%d seed %d risk %d version %d %s: '
+                  '%d steps, %d dead ends, %d holes on the way' %
+                  (n, entry.width, entry.height, entry.seed, entry.risk,
+                   entry.version, entry.algorithm, entry.solution,
+                   entry.dead_ends, entry.hole_risk))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
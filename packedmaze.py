@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+from maze import Grid, Maze
+
+# magic, width, height, seed, risk, version, number of holes
+HEADER = struct.Struct('<4sIIqBBI')
+MAGIC = b'MZP1'
+HOLE = struct.Struct('<II')
+
+# bytes.translate() tables between wall tiles and the characters of a
+# binary number: a wall is '1', anything open is '0'
+_TILE_TO_BIT = bytes(ord('1') if tile == Maze.SOLID else ord('0')
+                     for tile in range(256))
+_BIT_TO_TILE = bytes(Maze.SOLID if byte == ord('1') else Maze.EMPTY
+                     for byte in range(256))
+
+
+class PackedMaze:
+    """A maze stored as its graph of rooms, two bits per room.
+
+    The rooms are the tiles at odd (x, y).  For room (c, r), at tile
+    (2c + 1, 2r + 1), bit r * columns + c of `east` is set when there is
+    a wall between it and the room to its right, and the same bit of
+    `south` when there is a wall below it.  Every other tile of the maze
+    is a wall, so that is all there is to keep.  Bits are numbered from
+    the lowest bit of the first byte.
+
+    Tiles are worked out on demand with get(), or all at once with
+    to_grid() or to_maze() to play on.  Mazes must have odd sizes, as
+    the game always makes them.
+    """
+
+    def __init__(self, width, height, east, south, holes=(), seed=0,
+                 risk=0, version=Maze.LEGACY):
+        if width % 2 == 0 or height % 2 == 0:
+            raise ValueError('packed mazes must have odd sizes')
+        self.width, self.height = width, height
+        self.columns, self.rows = (width - 1) // 2, (height - 1) // 2
+        self.east, self.south = east, south
+        self.holes = list(holes)
+        self._holes = set(self.holes)
+        self.seed, self.risk, self.version = seed, risk, version
+
+    @classmethod
+    def from_maze(cls, maze):
+        """Pack the walls and holes of a maze.  Trails, passed holes
+        and the goal are not kept."""
+        return cls.from_rows(maze.width, maze.height, maze.map.rows(),
+                             maze.holes, maze.seed, maze.risk, maze.version)
+
+    @classmethod
+    def from_rows(cls, width, height, rows, holes=(), seed=0, risk=0,
+                  version=Maze.LEGACY):
+        """Pack a maze from its rows of tiles, top to bottom, such as
+        the rows yielded by generators.eller_rows()."""
+        east, south = wall_digits(rows)
+        return cls.from_digits(width, height, east, south, holes, seed, risk,
+                               version)
+
+    @classmethod
+    def from_digits(cls, width, height, east, south, holes=(), seed=0,
+                    risk=0, version=Maze.LEGACY):
+        """Pack a maze from the rows of wall digits of wall_digits()."""
+        size = (((width - 1) // 2) * ((height - 1) // 2) + 7) // 8
+        return cls(width, height,
+                   _pack_bits(east, size), _pack_bits(south, size),
+                   holes, seed, risk, version)
+
+    def _bit(self, bits, c, r):
+        i = r * self.columns + c
+        return bits[i >> 3] >> (i & 7) & 1
+
+    def get(self, x, y):
+        """The tile at (x, y), as found in Maze.map."""
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return Maze.BORDER
+        if (x, y) in self._holes:
+            return Maze.HOLE
+        if x % 2 == 1 and y % 2 == 1:
+            return Maze.EMPTY
+        if x % 2 == 0 and y % 2 == 1 and 0 < x < self.width - 1:
+            wall = self._bit(self.east, x // 2 - 1, y // 2)
+        elif x % 2 == 1 and y % 2 == 0 and 0 < y < self.height - 1:
+            wall = self._bit(self.south, x // 2, y // 2 - 1)
+        else:
+            return Maze.SOLID
+        return Maze.SOLID if wall else Maze.EMPTY
+
+    def validMove(self, x, y):
+        return Maze.PASSABLE[self.get(x, y)]
+
+    def tile_rows(self):
+        """Expand the maze one row of tiles at a time, top to bottom."""
+        width, columns = self.width, self.columns
+        east = _unpack_bits(self.east, columns, self.rows)
+        south = _unpack_bits(self.south, columns, self.rows)
+        wall = bytes([Maze.SOLID]) * width
+        yield wall
+        for r in range(self.rows):
+            row = bytearray(wall)
+            row[1::2] = bytes([Maze.EMPTY]) * columns
+            row[2::2] = east[r * columns:(r + 1) * columns]
+            yield bytes(row)
+            row = bytearray(wall)
+            row[1::2] = south[r * columns:(r + 1) * columns]
+            yield bytes(row)
+
+    def to_grid(self):
+        grid = Grid(self.width, self.height, Maze.SOLID, Maze.BORDER)
+        for y, row in enumerate(self.tile_rows()):
+            start = grid.index(0, y)
+            grid.cells[start:start + self.width] = row
+        for x, y in self.holes:
+            grid.set(x, y, Maze.HOLE)
+        return grid
+
+    def to_maze(self, algorithm=Maze.BACKTRACKER):
+        """Unpack into a Maze that can be played.  The algorithm the
+        maze was built with is not packed, so it is given here."""
+        return Maze.from_grid(self.to_grid(), self.seed, self.risk,
+                              self.version, self.holes, algorithm)
+
+    def to_bytes(self):
+        """Serialize the maze: a HEADER, the east and south bitsets and
+        then the holes as pairs of little-endian unsigned ints."""
+        data = [HEADER.pack(MAGIC, self.width, self.height, self.seed,
+                            self.risk, self.version, len(self.holes)),
+                bytes(self.east), bytes(self.south)]
+        data.extend(HOLE.pack(x, y) for x, y in self.holes)
+        return b''.join(data)
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """Read a maze written by to_bytes() from any buffer.  The
+        bitsets are views into that buffer, not copies."""
+        view = memoryview(data)
+        magic, width, height, seed, risk, version, count = \
+            HEADER.unpack_from(view, offset)
+        if magic != MAGIC:
+            raise ValueError('not a packed maze')
+        size = (((width - 1) // 2) * ((height - 1) // 2) + 7) // 8
+        start = offset + HEADER.size
+        east = view[start:start + size]
+        south = view[start + size:start + 2 * size]
+        start += 2 * size
+        holes = [HOLE.unpack_from(view, start + i * HOLE.size)
+                 for i in range(count)]
+        return cls(width, height, east, south, holes, seed, risk, version)
+
+    def size(self):
+        """The number of bytes to_bytes() makes."""
+        return HEADER.size + len(self.east) + len(self.south) + \
+            HOLE.size * len(self.holes)
+
+
+def wall_digits(rows):
+    """Read the walls from rows of tiles, top to bottom.
+
+    Return two lists with one bytes per row of rooms: the east walls
+    and the south walls of its rooms, left to right, as b'1' for a wall
+    and b'0' for a passage.
+    """
+    east = []
+    south = []
+    for y, row in enumerate(rows):
+        if y % 2 == 1:
+            east.append(row[2::2].translate(_TILE_TO_BIT))
+        elif y > 0:
+            south.append(row[1::2].translate(_TILE_TO_BIT))
+    return east, south
+
+
+def _pack_bits(rows, size):
+    """Turn rows of '0'/'1' characters, first bit first, into bytes."""
+    digits = b''.join(rows)[::-1]
+    return int(digits or b'0', 2).to_bytes(size, 'little')
+
+
+def _unpack_bits(bits, columns, rows):
+    """Turn a bitset into one tile per bit, SOLID for set bits."""
+    count = columns * rows
+    digits = format(int.from_bytes(bits, 'little'), '0%db' % count)
+    return digits[::-1][:count].encode().translate(_BIT_TO_TILE)
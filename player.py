@@ -25,185 +25,229 @@
 import math
 import unicodedata
 
+import cairo
 from sugar3.graphics import style
 
-from maze import Rectangle
+from engine import FALL_END, falling_sizes
+from playerstore import NOT_FINISHED
+
+# background and foreground colours of the bonus players, standing and
+# falling
+_BONUS_COLORS = {
+    'left': ((0.45, 0.45, 0.45, 1.), (1., 1., 1., 1.),
+             (0.45, 0.45, 0.45, 1.)),
+    'right': ((0.55, 0.55, 0.55, 1.), (0., 0., 0., 1.),
+              (0.55, 0.55, 0.55, 1.)),
+}
+
+# the faces drawn so far, see Player.frames(), and how many sets of
+# them to keep before starting over
+_FRAMES = {}
+_FRAMES_KEPT = 64
+
+
+def _face(look, size, bg, fg, face_size):
+    """A face looking to look, face_size pixels wide, in the middle of
+    a transparent tile size pixels wide."""
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+    ctx = cairo.Context(surface)
+    line_width = size / 32.
+
+    # centre of face
+    cx = cy = size / 2
+    size = face_size
+
+    # a background filled circle with foreground border
+    ctx.arc(cx, cy, (size / 2 - line_width), 0, 2 * math.pi)
+    ctx.set_source_rgba(*bg)
+    ctx.set_line_width(line_width)
+    ctx.fill_preserve()
+    ctx.set_source_rgba(*fg)
+    ctx.stroke()
+
+    # two eyes
+    for ex in [cx - 0.20 * size, cx + 0.20 * size]:
+        # conjunctiva
+        er = 0.14 * size
+        ey = cy - 0.05 * size
+        ctx.arc(ex, ey, er, 0, 2 * math.pi)
+        ctx.set_source_rgba(1., 1., 1., 1.)
+        ctx.fill()
+        # iris, pupil
+        er = 0.04 * size
+        if look == 'left':
+            ex -= 0.04 * size
+        elif look == 'right':
+            ex += 0.04 * size
+        else:
+            ey += 0.02 * size
+        ctx.arc(ex, ey, er, 0, 2 * math.pi)
+        ctx.set_source_rgba(0., 0., 0., 1.)
+        ctx.fill()
+
+    # mouth
+    (lx, ly) = (cx - 0.25 * size, cy + 0.15 * size)  # left corner
+    (bx, by) = (cx, cy + 0.25 * size)  # weak control
+    (rx, ry) = (cx + 0.25 * size, cy + 0.15 * size)  # right corner
+    (tx, ty) = (cx, cy + 0.50 * size)  # strong control
+    ctx.set_source_rgba(1., 1., 1., 1.)
+    ctx.curve_to(lx, ly, bx, by, rx, ry)  # upper lip
+    ctx.curve_to(rx, ry, tx, ty, lx, ly)  # lower lip
+    ctx.fill_preserve()
+    ctx.stroke()
+
+    surface.flush()
+    return surface
 
 
 class Player:
-    def __init__(self, buddy, look='centre'):
+    """A player, and a view of its slot of a PlayerStore, which holds
+    everything about it that changes while playing.  The store is the
+    one of the engine.Engine whose rules the player moves by."""
+
+    __slots__ = ('buddy', 'nick', 'fg', 'bg', 'look', 'bonusplayers',
+                 'store', 'slot', '_colors')
+
+    def __init__(self, buddy, store, look='centre'):
         self.buddy = buddy
         name = buddy.props.nick
         self.nick = unicodedata.normalize('NFC', name)
         colors = buddy.props.color.split(",")
         self.fg = style.Color(colors[0])
         self.bg = style.Color(colors[1])
-        self.victories = 0
+        if look == 'centre':
+            # the falling foreground is the colour of the hole
+            self._colors = (tuple(self.bg.get_rgba()),
+                            tuple(self.fg.get_rgba()), None)
+        else:
+            self._colors = _BONUS_COLORS[look]
 
-        # this field is None when the activity is not shared and when
+        # uid is None when the activity is not shared and when
         # the user shared it this field will become to
         # "olpcgames.mesh.my_handle()"
-        self.uid = None
+        self.store = store
+        self.slot = self.store.add()
 
         self.look = look
-        self.hidden = False
         self.bonusplayers = None
         self.reset()
-        self.falling = 0
 
-    def draw(self, ctx, bounds, size, hole_color):
-        line_width = size / 32.
-        rect = Rectangle(bounds.x + self.position[0] * size,
-                         bounds.y + self.position[1] * size, size,
-                         size)
+    @property
+    def position(self):
+        return (self.store.x[self.slot], self.store.y[self.slot])
 
-        ctx.save()
+    @position.setter
+    def position(self, position):
+        self.store.move(self.slot, *position)
 
-        # centre of face
-        cx = rect.x + size / 2
-        cy = rect.y + size / 2
-
-        bg = {
-            'centre': self.bg.get_rgba(),
-            'left': [0.45, 0.45, 0.45, 1.],
-            'right': [0.55, 0.55, 0.55, 1.]
-        }
-        fg = {
-            'centre': self.fg.get_rgba(),
-            'left': [1., 1., 1., 1.],
-            'right': [0., 0., 0., 1.]
-        }
-        if self.falling > 20:
-            fg = {
-                'centre': hole_color,
-                'left': [0.45, 0.45, 0.45, 1.],
-                'right': [0.55, 0.55, 0.55, 1.]
-            }
-            size = self.falling
-
-        # a background filled circle with foreground border
-        ctx.arc(cx, cy, (size / 2 - line_width), 0, 2 * math.pi)
-        ctx.set_source_rgba(*bg[self.look])
-        ctx.set_line_width(line_width)
-        ctx.fill_preserve()
-        ctx.set_source_rgba(*fg[self.look])
-        ctx.stroke()
-
-        # two eyes
-        for ex in [cx - 0.20 * size, cx + 0.20 * size]:
-            # conjunctiva
-            er = 0.14 * size
-            ey = cy - 0.05 * size
-            ctx.arc(ex, ey, er, 0, 2 * math.pi)
-            ctx.set_source_rgba(1., 1., 1., 1.)
-            ctx.fill()
-            # iris, pupil
-            er = 0.04 * size
-            if self.look == 'left':
-                ex -= 0.04 * size
-            elif self.look == 'right':
-                ex += 0.04 * size
-            else:
-                ey += 0.02 * size
-            ctx.arc(ex, ey, er, 0, 2 * math.pi)
-            ctx.set_source_rgba(0., 0., 0., 1.)
-            ctx.fill()
-
-        # mouth
-        (lx, ly) = (cx - 0.25 * size, cy + 0.15 * size)  # left corner
-        (bx, by) = (cx, cy + 0.25 * size)  # weak control
-        (rx, ry) = (cx + 0.25 * size, cy + 0.15 * size)  # right corner
-        (tx, ty) = (cx, cy + 0.50 * size)  # strong control
-        ctx.set_source_rgba(1., 1., 1., 1.)
-        ctx.curve_to(lx, ly, bx, by, rx, ry)  # upper lip
-        ctx.curve_to(rx, ry, tx, ty, lx, ly)  # lower lip
-        ctx.fill_preserve()
-        ctx.stroke()
+    @property
+    def previous(self):
+        return (self.store.px[self.slot], self.store.py[self.slot])
+
+    @previous.setter
+    def previous(self, position):
+        self.store.px[self.slot], self.store.py[self.slot] = position
 
+    @property
+    def direction(self):
+        return (self.store.dx[self.slot], self.store.dy[self.slot])
+
+    @direction.setter
+    def direction(self, direction):
+        self.store.dx[self.slot], self.store.dy[self.slot] = direction
+
+    @property
+    def falling(self):
+        return self.store.falling[self.slot]
+
+    @falling.setter
+    def falling(self, falling):
+        self.store.falling[self.slot] = falling
+
+    @property
+    def elapsed(self):
+        """Seconds to reach the goal, None until then."""
+        elapsed = self.store.elapsed[self.slot]
+        return None if math.isnan(elapsed) else elapsed
+
+    @elapsed.setter
+    def elapsed(self, elapsed):
+        self.store.elapsed[self.slot] = \
+            NOT_FINISHED if elapsed is None else elapsed
+
+    @property
+    def hidden(self):
+        return bool(self.store.hidden[self.slot])
+
+    @hidden.setter
+    def hidden(self, hidden):
+        self.store.hidden[self.slot] = hidden
+
+    @property
+    def victories(self):
+        return self.store.victories[self.slot]
+
+    @victories.setter
+    def victories(self, victories):
+        self.store.victories[self.slot] = victories
+
+    @property
+    def uid(self):
+        return self.store.uids[self.slot]
+
+    @uid.setter
+    def uid(self, uid):
+        self.store.set_uid(self.slot, uid)
+
+    def frames(self, size, hole_color):
+        """The faces of this player on a tile size pixels wide, by
+        falling size: 0 standing, then one per step of a fall.  They
+        are drawn once for every player with the same look and
+        colours."""
+        key = (self.look, size, self._colors, hole_color)
+        frames = _FRAMES.get(key)
+        if frames is None:
+            if len(_FRAMES) >= _FRAMES_KEPT:
+                _FRAMES.clear()
+            bg, fg, falling_fg = self._colors
+            frames = {0: _face(self.look, size, bg, fg, size)}
+            for falling in falling_sizes(size):
+                frames[falling] = _face(self.look, size, bg,
+                                        falling_fg or hole_color, falling)
+            _FRAMES[key] = frames
+        return frames
+
+    def draw(self, ctx, bounds, size, hole_color):
+        falling = self.falling
+        if falling <= FALL_END:
+            falling = 0
+        frames = self.frames(size, hole_color)
+        face = frames.get(falling)
+        if face is None:
+            # a fall that started at another tile size
+            bg, fg, falling_fg = self._colors
+            face = _face(self.look, size, bg, falling_fg or hole_color,
+                         falling)
+        x = bounds.x + self.position[0] * size
+        y = bounds.y + self.position[1] * size
+        ctx.save()
+        ctx.set_source_surface(face, x, y)
+        ctx.rectangle(x, y, size, size)
+        ctx.fill()
         ctx.restore()
 
     def reset(self):
-        self.direction = (0, 0)
-        self.position = (1, 1)
-        self.previous = (1, 1)
-        self.elapsed = None
+        self.store.reset(self.slot)
         if self.look != 'centre':
             self.hidden = True
 
-    def animate(self, maze, size, change_direction=True):
-        # if player is falling
-        if self.falling > 0:
-            self.falling -= max(1, int(size / 4))
-            if self.falling <= 20:
-                self.falling = 0
-                self.reset()
-            return (True, self.position)
-
-        # if the player finished the maze, then don't move
-        if maze.map[self.position[0]][self.position[1]] == maze.GOAL:
-            self.direction = (0, 0)
-            return (False, self.position)
-
-        if maze.map[self.position[0]][self.position[1]] == \
-                maze.HOLE or (maze.map[self.position[0]][self.position[1]] ==
-                              maze.PASSED and self.falling > 0):
-            self.direction = (0, 0)
-            return (True, self.position)
-
-        if self.canGo(self.direction, maze):
-            self.move(self.direction, maze)
-            if change_direction:
-                self.keepGoing(self.direction, maze)
-            return (True, self.position)
-
-        self.direction = (0, 0)
-        return (False, self.position)
-
-    def move(self, direction, maze):
-        """Move the player in a given direction (deltax,deltay)"""
-        newposition = (self.position[0] + direction[0],
-                       self.position[1] + direction[1])
-        self.previous = self.position
-        self.position = newposition
-
-    def fallThroughHole(self, tile_size):
-        self.falling = tile_size
-
-    def canGo(self, direction, maze):
-        """Can the player go in this direction without bumping into
-           something?
-        """
-        newposition = (self.position[0] + direction[0],
-                       self.position[1] + direction[1])
-        return maze.validMove(newposition[0], newposition[1])
-
-    def cameFrom(self, direction):
-        """Note the position/direction that we just came from."""
-        return self.previous == (self.position[0] + direction[0],
-                                 self.position[1] + direction[1])
-
-    def keepGoing(self, curdir, maze):
-        """Try to keep going if the direction is obvious.
-        This prevents the player from having to use the arrows to navigate
-        every single twist and turn of large mazes."""
-        # possible directions are fwd, turn left, turn right
-        directions = [curdir, (curdir[1], curdir[0]),
-                      (- curdir[1], - curdir[0])]
-        # remove any that are blocked
-        for d in list(directions):
-            if not self.canGo(d, maze):
-                directions.remove(d)
-        # is there only one possible direction?
-        if len(directions) == 1:
-            self.direction = directions[0]
-        else:
-            self.direction = (0, 0)
-
     def bonusPlayers(self):
+        """The two extra players sharing this XO, made the first time
+        they are needed."""
         if self.bonusplayers is None:
             self.bonusplayers = []
-            self.bonusplayers.append(Player(self.buddy, 'left'))
-            self.bonusplayers.append(Player(self.buddy, 'right'))
+            self.bonusplayers.append(Player(self.buddy, self.store, 'left'))
+            self.bonusplayers.append(Player(self.buddy, self.store, 'right'))
 
             count = 1
             for player in self.bonusplayers:
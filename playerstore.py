@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+import math
+
+NOT_FINISHED = float('nan')
+
+
+class PlayerStore:
+    """The changing state of every player, in parallel arrays.
+
+    Each player has a slot, the same index into every array: position
+    x and y, previous position px and py, direction dx and dy, falling,
+    elapsed (NOT_FINISHED until the player reaches the goal), hidden
+    and victories.  Slots of players who left are reused.  Players that
+    have a uid can be found by it with find(), and the players on a
+    tile with at(), so positions must be changed with move().
+
+    player.Player is a view of one slot, for code that deals with one
+    player at a time.
+    """
+
+    def __init__(self):
+        self.x, self.y = array('i'), array('i')
+        self.px, self.py = array('i'), array('i')
+        self.dx, self.dy = array('b'), array('b')
+        self.falling = array('i')
+        self.elapsed = array('d')
+        self.hidden = bytearray()
+        self.victories = array('i')
+        self.uids = []
+        self._slots = {}
+        self._free = []
+        # the slots on each (x, y) tile, in the order they came
+        self._cells = {}
+
+    def add(self, uid=None, hidden=False):
+        """Make room for a new player and return its slot."""
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self.uids)
+            for column in (self.x, self.y, self.px, self.py, self.dx,
+                           self.dy, self.falling, self.victories):
+                column.append(0)
+            self.elapsed.append(NOT_FINISHED)
+            self.hidden.append(0)
+            self.uids.append(None)
+        self.victories[slot] = 0
+        self.hidden[slot] = hidden
+        self.set_uid(slot, uid)
+        self.reset(slot)
+        return slot
+
+    def remove(self, slot):
+        self._leave(slot)
+        self.set_uid(slot, None)
+        self.hidden[slot] = 1
+        self.dx[slot] = self.dy[slot] = 0
+        self.falling[slot] = 0
+        self._free.append(slot)
+
+    def set_uid(self, slot, uid):
+        old = self.uids[slot]
+        if old is not None and self._slots.get(old) == slot:
+            del self._slots[old]
+        self.uids[slot] = uid
+        if uid is not None:
+            self._slots[uid] = slot
+
+    def find(self, uid):
+        """The slot of the player with this uid, or None."""
+        return self._slots.get(uid)
+
+    def move(self, slot, x, y):
+        """Put a player on the tile at (x, y)."""
+        self._leave(slot)
+        self.x[slot], self.y[slot] = x, y
+        self._cells.setdefault((x, y), []).append(slot)
+
+    def _leave(self, slot):
+        position = (self.x[slot], self.y[slot])
+        cell = self._cells.get(position)
+        if cell is not None and slot in cell:
+            cell.remove(slot)
+            if not cell:
+                del self._cells[position]
+
+    def at(self, x, y, hidden=False):
+        """The slots of the players on the tile at (x, y), the hidden
+        ones too if hidden is true."""
+        slots = self._cells.get((x, y), ())
+        if hidden:
+            return list(slots)
+        return [slot for slot in slots if not self.hidden[slot]]
+
+    def reset(self, slot):
+        """Back to the start, standing still, not falling, not
+        finished."""
+        self.move(slot, 1, 1)
+        self.px[slot] = self.py[slot] = 1
+        self.dx[slot] = self.dy[slot] = 0
+        self.falling[slot] = 0
+        self.elapsed[slot] = NOT_FINISHED
+
+    def slots(self):
+        """The slots in use."""
+        free = set(self._free)
+        return [slot for slot in range(len(self.uids)) if slot not in free]
+
+    def moving(self):
+        """The slots of the players walking or falling."""
+        dx, dy, falling = self.dx, self.dy, self.falling
+        return [slot for slot in self.slots()
+                if dx[slot] or dy[slot] or falling[slot]]
+
+    def unfinished(self):
+        """The slots of the players shown that have not reached the
+        goal yet."""
+        hidden, elapsed = self.hidden, self.elapsed
+        return [slot for slot in self.slots()
+                if not hidden[slot] and math.isnan(elapsed[slot])]
+
+    def finished(self):
+        """The slots of the players that reached the goal, fastest
+        first."""
+        elapsed = self.elapsed
+        return sorted((slot for slot in self.slots()
+                       if not math.isnan(elapsed[slot])),
+                      key=elapsed.__getitem__)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A small pseudo-random number generator that is the same everywhere.
+
+Mazes are rebuilt by every peer from a seed, so the numbers drawn must
+not depend on the Python version.  random.Random makes no such promise
+about choice() and randrange(); this generator is fully specified here:
+
+state
+    32 bits, never zero.  The seed is folded to 32 bits with
+    (seed ^ (seed >> 32)) & 0xffffffff and then mixed with the
+    "lowbias32" integer hash:
+
+        x ^= x >> 16; x *= 0x7feb352d; x ^= x >> 15
+        x *= 0x846ca68b; x ^= x >> 16          (all modulo 2**32)
+
+    A mixed state of zero is replaced by 0x9e3779b9.
+
+next()
+    Marsaglia's xorshift32 with shifts 13, 17, 5, returning the new
+    state:
+
+        x ^= x << 13; x ^= x >> 17; x ^= x << 5    (modulo 2**32)
+
+randbelow(n)
+    (next() * n) >> 32, an integer in [0, n).  The bias is below
+    n / 2**32, which is nothing for a maze, and no value is ever
+    rejected, so every call advances the state exactly once.
+
+Code that needs the speed may inline next(), as long as it writes the
+state back when it is done.
+"""
+
+MASK = 0xffffffff
+
+
+def seed_state(seed):
+    """The initial 32-bit state for an integer seed."""
+    x = (seed ^ (seed >> 32)) & MASK
+    x ^= x >> 16
+    x = (x * 0x7feb352d) & MASK
+    x ^= x >> 15
+    x = (x * 0x846ca68b) & MASK
+    x ^= x >> 16
+    return x or 0x9e3779b9
+
+
+class XorShift32:
+
+    def __init__(self, seed):
+        self.state = seed_state(seed)
+
+    def next(self):
+        x = self.state
+        x ^= (x << 13) & MASK
+        x ^= x >> 17
+        x ^= (x << 5) & MASK
+        self.state = x
+        return x
+
+    def randbelow(self, n):
+        return (self.next() * n) >> 32
+
+    def randrange(self, start, stop, step=1):
+        count = (stop - start + step - 1) // step
+        if count <= 0:
+            raise ValueError('empty range for randrange()')
+        return start + step * self.randbelow(count)
+
+    def choice(self, seq):
+        return seq[self.randbelow(len(seq))]
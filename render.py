@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+from math import pi
+import sys
+
+import cairo
+
+from maze import Grid, Maze
+
+# the tile drawn on the maze layer for each tile value that is not
+# plain: the floor under marks, see TileAtlas
+_BACKGROUND = {Maze.SEEN: Maze.EMPTY, Maze.HOLE: Maze.EMPTY,
+               Maze.PASSED: Maze.EMPTY, Maze.BORDER: Maze.SOLID}
+
+# where the red, green and blue bytes of a cairo.FORMAT_RGB24 pixel are
+_RGB = (2, 1, 0) if sys.byteorder == 'little' else (1, 2, 3)
+
+# the mark of a SEEN tile while the trail is shown, after the tile
+# values that are marks of their own
+TRAIL = Maze.PASSED + 1
+
+# bytes.translate() tables from tile values to their mark, or 0 for
+# none, with the trail shown and hidden
+_MARK = {Maze.HOLE: Maze.HOLE, Maze.PASSED: Maze.PASSED, Maze.SEEN: TRAIL}
+_MARKS_TRAIL = bytes(_MARK.get(tile, 0) for tile in range(256))
+_MARKS = _MARKS_TRAIL.replace(bytes([TRAIL]), b'\0')
+
+
+class TileAtlas:
+    """The tiles of a maze drawn once, for MazeGame.redraw() to copy
+    from, in two parts that go on separate layers.
+
+    The floor is the walls, the goal and the empty tiles, in plain
+    colours: paint_floor() draws a whole maze of it at once, from one
+    pixel per cell scaled up.  Marks go on top of the floor and change
+    while playing: holes, passed holes and the dot of the trail on SEEN
+    tiles, TRAIL.  They are drawn side by side on one transparent
+    surface, one column per mark, for paint_mark() to copy a tile at a
+    time.
+
+    colors has the colour of the SOLID, EMPTY, GOAL, HOLE and PASSED
+    tiles, and trail the colour of the dot.
+    """
+
+    def __init__(self, target, size, colors, trail):
+        self.size = size
+        # a bytes.translate() table per byte of a pixel, from tile
+        # values to that byte of the colour of the floor
+        self._channels = [bytearray(256) for n in range(4)]
+        for tile in range(256):
+            color = colors.get(_BACKGROUND.get(tile, tile))
+            if color is not None:
+                for n, value in zip(_RGB, color):
+                    self._channels[n][tile] = round(value * 255)
+        self._channels = [bytes(table) for table in self._channels]
+
+        self.surface = target.create_similar(
+            cairo.CONTENT_COLOR_ALPHA, size * (TRAIL + 1), size)
+        ctx = cairo.Context(self.surface)
+        center = size / 2
+
+        ctx.set_source_rgb(*colors[Maze.PASSED])
+        ctx.rectangle(Maze.PASSED * size, 0, size, size)
+        ctx.fill()
+
+        # a hole, ringed by the colour of the walls
+        line_width = size / 32.
+        ctx.arc(Maze.HOLE * size + center, center, center - line_width,
+                0, 2 * pi)
+        ctx.set_source_rgb(*colors[Maze.HOLE])
+        ctx.set_line_width(line_width)
+        ctx.fill_preserve()
+        ctx.set_source_rgb(*colors[Maze.SOLID])
+        ctx.stroke()
+
+        # the dot of the trail
+        radius = size / 3 - int(size / 5)
+        ctx.arc(TRAIL * size + center, center, radius, 0, 2 * pi)
+        ctx.set_source_rgba(*trail)
+        ctx.fill()
+
+    def pixels(self, cells):
+        """The cells of a grid as cairo.FORMAT_RGB24 pixels, one per
+        cell, in the colour of the floor of each tile."""
+        data = bytearray(4 * len(cells))
+        for n, table in enumerate(self._channels):
+            data[n::4] = cells.translate(table)
+        return data
+
+    def paint_floor(self, ctx, grid, x, y):
+        """Draw the floor of every tile of grid with its top-left corner
+        at (x, y), in pixels."""
+        rows = len(grid.cells) // grid.stride
+        image = cairo.ImageSurface.create_for_data(
+            self.pixels(grid.cells), cairo.FORMAT_RGB24, grid.stride, rows,
+            4 * grid.stride)
+        ctx.save()
+        ctx.translate(x, y)
+        ctx.scale(self.size, self.size)
+        ctx.set_source_surface(image, -Grid.PAD, -Grid.PAD)
+        ctx.get_source().set_filter(cairo.FILTER_NEAREST)
+        ctx.rectangle(0, 0, grid.width, grid.height)
+        ctx.fill()
+        ctx.restore()
+
+    def mark(self, tile, trail=True):
+        """The mark of a tile value, 0 if it has none."""
+        return (_MARKS_TRAIL if trail else _MARKS)[tile]
+
+    def marks(self, cells, trail=True):
+        """The mark of each cell, 0 where there is none."""
+        return cells.translate(_MARKS_TRAIL if trail else _MARKS)
+
+    def paint_mark(self, ctx, mark, x, y):
+        """Put a mark on the tile at (x, y), in pixels, instead of
+        whatever was there.  Mark 0 leaves the tile clear."""
+        ctx.save()
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        if mark:
+            ctx.set_source_surface(self.surface, x - mark * self.size, y)
+        else:
+            ctx.set_source_rgba(0, 0, 0, 0)
+        ctx.rectangle(x, y, self.size, self.size)
+        ctx.fill()
+        ctx.restore()
+
+    def paint_marks(self, ctx, grid, x, y, trail=True):
+        """Put the marks of every tile of grid on a clear surface, with
+        the top-left corner of the maze at (x, y).  Return the marks, as
+        marks() does."""
+        marks = self.marks(grid.cells, trail)
+        for i in itertools.compress(range(len(marks)), marks):
+            tx, ty = grid.position(i)
+            ctx.set_source_surface(self.surface,
+                                   x + (tx - marks[i]) * self.size,
+                                   y + ty * self.size)
+            ctx.rectangle(x + tx * self.size, y + ty * self.size,
+                          self.size, self.size)
+            ctx.fill()
+        return marks
+
+
+# the colours of an exported maze, for paper
+PRINT_COLORS = {Maze.SOLID: (0., 0., 0.), Maze.EMPTY: (1., 1., 1.),
+                Maze.GOAL: (0., 0.75, 0.), Maze.HOLE: (0.85, 0., 0.),
+                Maze.PASSED: (0., 0.5, 0.5)}
+
+
+def export(maze, path, size=8, colors=PRINT_COLORS):
+    """Draw maze to path, an SVG file if its name ends in .svg, else a
+    PDF, as vectors, size points to a tile.  The walls are the few
+    rectangles of Maze.walls(), so the file stays small."""
+    width, height = maze.width * size, maze.height * size
+    if path.lower().endswith('.svg'):
+        surface = cairo.SVGSurface(path, width, height)
+    else:
+        surface = cairo.PDFSurface(path, width, height)
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(*colors[Maze.EMPTY])
+    ctx.paint()
+
+    ctx.set_source_rgb(*colors[Maze.SOLID])
+    for x, y, w, h in maze.walls():
+        ctx.rectangle(x * size, y * size, w * size, h * size)
+    ctx.fill()
+
+    ctx.set_source_rgb(*colors[Maze.GOAL])
+    ctx.rectangle((maze.width - 2) * size, (maze.height - 2) * size,
+                  size, size)
+    ctx.fill()
+
+    center, line_width = size / 2, size / 32.
+    ctx.set_line_width(line_width)
+    for x, y in maze.holes:
+        if maze.map.get(x, y) == Maze.PASSED:
+            ctx.set_source_rgb(*colors[Maze.PASSED])
+            ctx.rectangle(x * size, y * size, size, size)
+            ctx.fill()
+            continue
+        ctx.arc(x * size + center, y * size + center, center - line_width,
+                0, 2 * pi)
+        ctx.set_source_rgb(*colors[Maze.HOLE])
+        ctx.fill_preserve()
+        ctx.set_source_rgb(*colors[Maze.SOLID])
+        ctx.stroke()
+    surface.finish()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Maze.activity
+# A simple multi-player maze game for the XO laptop.
+# http://wiki.laptop.org/go/Maze
+#
+# This file is part of Maze.activity
+#
+#     Maze.activity is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Maze.activity is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with Maze.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+
+from maze import Maze
+
+# bytes.translate() table from tile values to 1 where the way to the
+# goal can go through, 0 where it can't: walls, the border and holes
+# that have not been passed yet
+_WALKABLE = bytes(0 if tile == Maze.HOLE else int(passable)
+                  for tile, passable in enumerate(Maze.PASSABLE))
+
+
+class DistanceField:
+    """The number of steps from every tile of a maze to the goal.
+
+    One breadth-first search from the goal fills `distances`, an array
+    with one int per cell of maze.map (-1 where the goal can't be
+    reached), so every question about the way to the goal is a lookup
+    or a walk down the distances.  Holes block the way until they are
+    passed; tell the field with open() and it only updates the tiles
+    that are now closer.
+    """
+
+    def __init__(self, maze, goal=None):
+        self.maze = maze
+        if goal is None:
+            goal = (maze.width - 2, maze.height - 2)
+        self.goal = goal
+        grid = maze.map
+        self._steps = [grid.offsets[d] for d in Maze.DIRECTIONS]
+        self._walkable = bytearray(grid.cells.translate(_WALKABLE))
+        self.distances = array('i', [-1]) * len(grid.cells)
+        start = grid.index(*goal)
+        if self._walkable[start]:
+            self.distances[start] = 0
+            self._spread([start])
+
+    def copy(self, maze):
+        """The same field for a copy of its maze, to be opened on its
+        own."""
+        field = DistanceField.__new__(DistanceField)
+        field.__dict__.update(self.__dict__)
+        field.maze = maze
+        field._walkable = bytearray(self._walkable)
+        field.distances = array('i', self.distances)
+        return field
+
+    def _spread(self, frontier):
+        """Carry on the search from the frontier cells, lowering every
+        distance that they make shorter."""
+        distances, walkable, steps = \
+            self.distances, self._walkable, self._steps
+        while frontier:
+            following = []
+            for i in frontier:
+                d = distances[i] + 1
+                for step in steps:
+                    j = i + step
+                    if walkable[j] and not 0 <= distances[j] <= d:
+                        distances[j] = d
+                        following.append(j)
+            frontier = following
+
+    def open(self, x, y):
+        """A tile at (x, y), such as a passed hole, can now be walked
+        through."""
+        grid = self.maze.map
+        i = grid.index(x, y)
+        if self._walkable[i]:
+            return
+        self._walkable[i] = 1
+        around = [self.distances[i + step] for step in self._steps
+                  if self.distances[i + step] >= 0]
+        if around:
+            self.distances[i] = min(around) + 1
+            self._spread([i])
+
+    def distance(self, x, y):
+        """The number of steps from (x, y) to the goal, or -1 if it
+        can't be reached."""
+        grid = self.maze.map
+        return self.distances[grid.origin + y * grid.stride + x]
+
+    def next_step(self, x, y):
+        """The direction (dx, dy) of one step towards the goal, or None
+        at the goal or where it can't be reached."""
+        grid = self.maze.map
+        i = grid.index(x, y)
+        d = self.distances[i]
+        if d <= 0:
+            return None
+        for direction, step in zip(Maze.DIRECTIONS, self._steps):
+            if self.distances[i + step] == d - 1:
+                return direction
+        return None
+
+    def path(self, x, y):
+        """The tiles of a shortest path from (x, y) to the goal, both
+        ends included, or [] if the goal can't be reached."""
+        grid = self.maze.map
+        distances, steps = self.distances, self._steps
+        i = grid.index(x, y)
+        d = distances[i]
+        if d < 0:
+            return []
+        path = [i]
+        while d > 0:
+            d -= 1
+            for step in steps:
+                if distances[i + step] == d:
+                    i += step
+                    break
+            path.append(i)
+        return [grid.position(i) for i in path]